@@ -0,0 +1,326 @@
+"""
+Collision-free ID allocation for URLShortener short codes
+
+Block mode (BlockIDAllocator): IDs come from a counter shared by every
+worker (MemoryIDCounter within one process, FileIDCounter across
+processes). A worker leases a contiguous block of `block_size` IDs with
+one counter update and then hands them out on its own, with no lock, so
+the shared counter is touched once per block rather than once per ID.
+IDs left in a block when a worker exits are never reused; that only
+leaves gaps.
+
+FileIDCounter keeps the high-water mark as a u64 in a small file, updated
+under an exclusive flock and fsynced before the lease is returned, so two
+processes (or a restarted one) can never be handed overlapping blocks.
+flock belongs to the open file, which a forked child shares with its
+parent, so a counter used after a fork reopens the file in the child.
+
+Snowflake mode (SnowflakeIDAllocator) needs no shared state at all once
+each worker has a distinct worker id:
+
+    id  41 bits milliseconds since `epoch` | 10 bits worker | 12 bits sequence
+
+The IDs are 63-bit, so their Base62 codes are 11 characters long rather
+than the 5-6 of a counter, but they are roughly time-ordered and need no
+coordination to issue.
+"""
+import fcntl
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+HIGH_WATER = struct.Struct("<Q")
+
+
+class MemoryIDCounter:
+    """Shared counter for the workers of one process; forgotten on restart"""
+
+    def __init__(self, start: int = 1):
+        self._next = start
+        self._lock = threading.Lock()
+        self.leases = 0
+
+    def lease(self, size: int) -> int:
+        """Reserve [first, first + size); returns first"""
+        with self._lock:
+            first = self._next
+            self._next += size
+            self.leases += 1
+            return first
+
+    def close(self) -> None:
+        pass
+
+
+class FileIDCounter:
+    """Durable counter in a file, safe to share between processes"""
+
+    def __init__(self, path: str, start: int = 1):
+        """
+        Args:
+            path: Counter file, created if missing
+            start: First ID handed out by a new counter file
+        """
+        self.path = path
+        self.start = start
+        self.leases = 0
+        self._lock = threading.Lock()  # flock excludes processes, not threads sharing the fd
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+
+    def _own_fd(self) -> int:
+        """This process's descriptor; one inherited across fork would share the parent's flock"""
+        if self._pid != os.getpid():
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def lease(self, size: int) -> int:
+        """Reserve [first, first + size) on disk; returns first"""
+        with self._lock:
+            fd = self._own_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                stored = os.pread(fd, HIGH_WATER.size, 0)
+                first = HIGH_WATER.unpack(stored)[0] if len(stored) == HIGH_WATER.size else self.start
+                os.pwrite(fd, HIGH_WATER.pack(first + size), 0)
+                os.fsync(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self.leases += 1
+            return first
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class BlockIDAllocator:
+    """
+    Issues IDs from blocks leased off a shared counter, one block per thread
+
+    Each thread keeps its current block as a range iterator in a
+    threading.local, so next_id() is an attribute read and a next() call;
+    only a thread whose block has run out goes to the counter.
+    """
+
+    def __init__(self, counter=None, block_size: int = 1_000):
+        """
+        Args:
+            counter: MemoryIDCounter (the default) or FileIDCounter
+            block_size: IDs leased per counter update
+        """
+        self.counter = counter if counter is not None else MemoryIDCounter()
+        self.block_size = block_size
+        self._local = threading.local()
+
+    def next_id(self) -> int:
+        block = getattr(self._local, "block", None)
+        if block is not None:
+            issued = next(block, None)
+            if issued is not None:
+                return issued
+        first = self.counter.lease(self.block_size)
+        block = self._local.block = iter(range(first, first + self.block_size))
+        return next(block)
+
+    def id_stream(self) -> Iterator[int]:
+        """
+        IDs for a caller drawing many on this thread (bulk imports)
+
+        Starts with what is left of the thread's current block and leases
+        further blocks into it, so whatever the caller does not consume
+        is still issued by next_id() instead of being lost.
+        """
+        local = self._local
+        while True:
+            block = getattr(local, "block", None)
+            if block is not None:
+                yield from block
+            first = self.counter.lease(self.block_size)
+            local.block = iter(range(first, first + self.block_size))
+
+    def lease_block(self, size: Optional[int] = None) -> range:
+        """Lease a whole block for a caller that numbers items itself (bulk imports)"""
+        size = size or self.block_size
+        first = self.counter.lease(size)
+        return range(first, first + size)
+
+    def close(self) -> None:
+        self.counter.close()
+
+
+class SnowflakeIDAllocator:
+    """
+    Snowflake-style IDs: (milliseconds, worker id, sequence)
+
+    Distinct worker ids are all processes need to issue unique IDs; one
+    can be leased from a FileIDCounter (worker_id_from) so restarted or
+    newly added processes pick an unused one. Only 1024 ids exist and a
+    counter never hands one back, so that counter must be dedicated to
+    worker ids and reset when the whole fleet is stopped; wrapping past
+    1023 would give two live workers the same id and so the same IDs,
+    which worker_id_from refuses to do. Threads of one process share
+    the worker id and so the sequence, which a short lock protects. Up to
+    4096 IDs are issued per millisecond; past that, and if the clock steps
+    backwards, next_id() waits for the clock to move on.
+    """
+
+    TIME_BITS = 41
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_WORKER = (1 << WORKER_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+    EPOCH = 1_704_067_200_000  # 2024-01-01T00:00:00Z in milliseconds
+
+    def __init__(self, worker_id: int, epoch: int = EPOCH, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            worker_id: 0-1023, unique among all running workers
+            epoch: Start of the 41-bit millisecond range (about 69 years long)
+            clock: Wall-clock time source in seconds
+        """
+        if not 0 <= worker_id <= self.MAX_WORKER:
+            raise ValueError(f"worker_id must be between 0 and {self.MAX_WORKER}")
+        self.worker_id = worker_id
+        self.epoch = epoch
+        self.clock = clock
+        self._worker_bits = worker_id << self.SEQUENCE_BITS
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.waits = 0
+
+    @classmethod
+    def worker_id_from(cls, counter, **kwargs) -> "SnowflakeIDAllocator":
+        """
+        An allocator whose worker id is leased from a shared counter
+
+        Raises:
+            ValueError: The counter has already handed out all 1024 worker ids
+        """
+        worker_id = counter.lease(1)
+        if worker_id > cls.MAX_WORKER:
+            raise ValueError(f"worker id counter exhausted (leased {worker_id}); "
+                             f"reset it once no worker holds an id, or assign ids explicitly")
+        return cls(worker_id, **kwargs)
+
+    def _now_ms(self) -> int:
+        return int(self.clock() * 1000) - self.epoch
+
+    def next_id(self) -> int:
+        with self._lock:
+            now = self._now_ms()
+            if now < self._last_ms:
+                # Clock stepped back: never reuse a timestamp already issued from
+                self.waits += 1
+                while now < self._last_ms:
+                    time.sleep((self._last_ms - now) / 1000)
+                    now = self._now_ms()
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & self.MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond
+                    self.waits += 1
+                    while now <= self._last_ms:
+                        now = self._now_ms()
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (self.WORKER_BITS + self.SEQUENCE_BITS)) | self._worker_bits | self._sequence
+
+    def close(self) -> None:
+        pass
+
+
+def benchmark_allocators(path: str, threads: int = 8, ids_per_thread: int = 100_000) -> Dict[str, Dict[str, float]]:
+    """
+    IDs/s from `threads` threads for each allocator, and the duplicates seen
+
+    - locked_counter: one lock-protected counter, incremented per ID
+    - block_file: BlockIDAllocator leasing from a FileIDCounter at `path`
+    - snowflake: SnowflakeIDAllocator
+    """
+    class LockedCounter:
+        def __init__(self):
+            self.value = 0
+            self.lock = threading.Lock()
+
+        def next_id(self):
+            with self.lock:
+                self.value += 1
+                return self.value
+
+        def close(self):
+            pass
+
+    if os.path.exists(path):
+        os.remove(path)
+    allocators = {
+        "locked_counter": LockedCounter(),
+        "block_file": BlockIDAllocator(FileIDCounter(path)),
+        "snowflake": SnowflakeIDAllocator(1)
+    }
+    results = {}
+    for name, allocator in allocators.items():
+        issued = [None] * threads
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(t: int) -> None:
+            next_id = allocator.next_id
+            barrier.wait()
+            issued[t] = [next_id() for _ in range(ids_per_thread)]
+
+        workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        began = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - began
+        total = threads * ids_per_thread
+        results[name] = {
+            "ids_per_second": total / elapsed,
+            "duplicates": total - len(set().union(*issued))
+        }
+        allocator.close()
+    os.remove(path)
+    return results
+
+
+def _issue_from_file(path: str, count: int) -> list:
+    allocator = BlockIDAllocator(FileIDCounter(path), block_size=500)
+    issued = [allocator.next_id() for _ in range(count)]
+    allocator.close()
+    return issued
+
+
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    print("=== Short Code ID Allocation ===\n")
+    path = os.path.join(tempfile.mkdtemp(), "ids.counter")
+    for name, report in benchmark_allocators(path).items():
+        print(f"{name:>15}: {report['ids_per_second']:>12,.0f} ids/s across 8 threads, "
+              f"{report['duplicates']} duplicates")
+
+    # Four processes started together share one counter file
+    with ProcessPoolExecutor(4) as pool:
+        batches = list(pool.map(_issue_from_file, [path] * 4, [50_000] * 4))
+    issued = [i for batch in batches for i in batch]
+    print(f"\n4 processes, one counter file: {len(issued):,} ids issued, "
+          f"{len(issued) - len(set(issued))} duplicates")
+    os.remove(path)
+
+    snowflake = SnowflakeIDAllocator(7)
+    print(f"Snowflake id from worker 7: {snowflake.next_id()}")
+
+    try:
+        SnowflakeIDAllocator.worker_id_from(MemoryIDCounter(start=SnowflakeIDAllocator.MAX_WORKER + 1))
+        raise AssertionError("worker id counter wrapped into a reused id")
+    except ValueError as exc:
+        print(f"Worker id 1024 refused: {exc}")
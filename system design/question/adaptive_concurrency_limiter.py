@@ -0,0 +1,321 @@
+import heapq
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from rate_limiter import VirtualClock
+
+
+class ConcurrencyLimitExceeded(RuntimeError):
+    """Raised when a permit is requested while the in-flight limit is reached"""
+
+
+class AIMDLimit:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit
+
+    The limit grows by one per successful sample while the limiter is at
+    least half used, and is multiplied by `backoff` on a drop (an error,
+    or a response slower than `latency_threshold`).
+    """
+
+    def __init__(self, initial: int = 20, min_limit: int = 1, max_limit: int = 1_000,
+                 backoff: float = 0.9, latency_threshold: Optional[float] = None):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+
+    def update(self, limit: float, rtt: float, inflight: int, dropped: bool) -> float:
+        if dropped or (self.latency_threshold is not None and rtt > self.latency_threshold):
+            return max(self.min_limit, limit * self.backoff)
+        if inflight * 2 >= limit:
+            return min(self.max_limit, limit + 1)
+        return limit
+
+
+class GradientLimit:
+    """
+    Gradient concurrency limit driven by latency alone
+
+    The ratio of the no-load RTT to the current RTT says how much queueing
+    the downstream is doing. Both are taken from an EWMA of the samples (the
+    no-load RTT is the lowest the EWMA has been recently), since raw
+    minimums of noisy latencies are far below any realistic baseline:
+
+        gradient  = clamp(tolerance * min_rtt / rtt, 0.5, 1.0)
+        new_limit = limit * gradient + sqrt(limit)
+
+    At no load the gradient is 1 and the limit grows by sqrt(limit) to
+    probe for more capacity; once requests start queueing, the RTT rises
+    and the limit shrinks until queueing stops. The limit moves towards
+    new_limit by `smoothing` per sample, and min_rtt is re-measured every
+    `min_rtt_samples` samples so a downstream that got permanently slower
+    is not held to its old best case. Errors count as a gradient of 0.5.
+    """
+
+    def __init__(self, initial: int = 20, min_limit: int = 1, max_limit: int = 1_000,
+                 smoothing: float = 0.2, tolerance: float = 1.5, rtt_smoothing: float = 0.1,
+                 min_rtt_samples: int = 1_000):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.rtt_smoothing = rtt_smoothing
+        self.min_rtt_samples = min_rtt_samples
+        self.min_rtt = math.inf
+        self.rtt = 0.0
+        self._samples = 0
+
+    def update(self, limit: float, rtt: float, inflight: int, dropped: bool) -> float:
+        if rtt <= 0:
+            # A coarse (or virtual) clock measured no time: nothing to learn about queueing
+            if not dropped:
+                return limit
+        else:
+            self._samples += 1
+            self.rtt = rtt if not self.rtt else self.rtt + self.rtt_smoothing * (rtt - self.rtt)
+            if self._samples % self.min_rtt_samples == 0:
+                self.min_rtt = self.rtt
+            self.min_rtt = min(self.min_rtt, self.rtt)
+
+        if dropped:
+            gradient = 0.5
+        else:
+            gradient = max(0.5, min(1.0, self.tolerance * self.min_rtt / self.rtt))
+        # Do not grow a limit the traffic is not even using
+        if gradient == 1.0 and inflight * 2 < limit:
+            return limit
+        target = limit * gradient + math.sqrt(limit)
+        limit += self.smoothing * (target - limit)
+        return max(self.min_limit, min(self.max_limit, limit))
+
+
+class Permit:
+    """
+    One admitted request; release it exactly once when the request ends
+
+    Usable as a context manager (sync or async): leaving the block with an
+    exception records the request as dropped.
+    """
+
+    __slots__ = ("limiter", "started_at", "released")
+
+    def __init__(self, limiter: "AdaptiveConcurrencyLimiter", started_at: float):
+        self.limiter = limiter
+        self.started_at = started_at
+        self.released = False
+
+    def release(self, dropped: bool = False) -> None:
+        if not self.released:
+            self.released = True
+            self.limiter._release(self, dropped)
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release(dropped=exc_type is not None)
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release(dropped=exc_type is not None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps in-flight requests, adjusting the cap from observed latency
+
+    A token bucket limits request *rate*, which has to be tuned for the
+    downstream's speed on a good day. This limits *concurrency* instead
+    (Little's law: in-flight = throughput x latency) and lets a limit
+    algorithm (GradientLimit by default, or AIMDLimit) move the cap as the
+    downstream slows down or recovers. Requests over the cap are rejected
+    immediately, so overload turns into fast rejections rather than an
+    ever-growing queue and unbounded tail latency.
+
+        with limiter.acquire():          # raises ConcurrencyLimitExceeded
+            call_downstream()
+
+        async with limiter.acquire():
+            await call_downstream()
+
+    try_acquire() returns None instead of raising, for callers that shed
+    load themselves.
+    """
+
+    def __init__(self, limit_algorithm=None, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the limiter
+
+        Args:
+            limit_algorithm: GradientLimit, AIMDLimit or any object with
+                `initial` and update(limit, rtt, inflight, dropped) -> limit
+            clock: Monotonic time source used to measure request latency
+        """
+        self.algorithm = limit_algorithm if limit_algorithm is not None else GradientLimit()
+        self.clock = clock
+        self.limit = float(self.algorithm.initial)
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> Optional[Permit]:
+        """Admit a request if under the current limit"""
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                self.rejected += 1
+                return None
+            self.inflight += 1
+            self.admitted += 1
+        return Permit(self, self.clock())
+
+    def acquire(self) -> Permit:
+        """Admit a request or raise ConcurrencyLimitExceeded"""
+        permit = self.try_acquire()
+        if permit is None:
+            raise ConcurrencyLimitExceeded(f"Concurrency limit of {int(self.limit)} reached")
+        return permit
+
+    def _release(self, permit: Permit, dropped: bool) -> None:
+        rtt = self.clock() - permit.started_at
+        with self._lock:
+            inflight = self.inflight
+            self.inflight -= 1
+            if dropped:
+                self.dropped += 1
+            self.limit = self.algorithm.update(self.limit, rtt, inflight, dropped)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "dropped": self.dropped
+            }
+
+
+def simulate_overload(limiter: Optional[AdaptiveConcurrencyLimiter], offered_rps: float = 1_200.0,
+                      workers: int = 8, mean_service: float = 0.01, duration: float = 10.0,
+                      seed: int = 11) -> Dict[str, float]:
+    """
+    Discrete-event load test of a downstream pushed past its capacity
+
+    The downstream has `workers` parallel workers with exponential service
+    times (capacity workers / mean_service requests per second) and queues
+    everything else FIFO. Poisson arrivals at `offered_rps` pass through
+    `limiter` (or straight in when None). Time is virtual, so the run is
+    deterministic and takes well under a second.
+
+    Returns:
+        Admitted/shed counts, goodput, p50/p99/p999 latency of admitted
+        requests and the average limit seen by arrivals
+    """
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    if limiter is not None:
+        limiter.clock = clock
+
+    events = []  # (time, sequence, kind, permit, arrived_at)
+    sequence = 0
+    t = 0.0
+    while t < duration:
+        t += rng.expovariate(offered_rps)
+        events.append((t, sequence, "arrival", None, t))
+        sequence += 1
+    heapq.heapify(events)
+
+    waiting = deque()
+    busy = 0
+    shed = 0
+    latencies = []
+    limit_samples = []
+    while events:
+        now, _, kind, permit, arrived_at = heapq.heappop(events)
+        clock.now = now
+        if kind == "arrival":
+            if limiter is not None:
+                limit_samples.append(limiter.limit)
+                permit = limiter.try_acquire()
+                if permit is None:
+                    shed += 1
+                    continue
+            if busy < workers:
+                busy += 1
+                heapq.heappush(events, (now + rng.expovariate(1 / mean_service), sequence, "done",
+                                        permit, arrived_at))
+                sequence += 1
+            else:
+                waiting.append((permit, arrived_at))
+        else:
+            latencies.append(now - arrived_at)
+            if permit is not None:
+                permit.release()
+            if waiting:
+                next_permit, next_arrived = waiting.popleft()
+                heapq.heappush(events, (now + rng.expovariate(1 / mean_service), sequence, "done",
+                                        next_permit, next_arrived))
+                sequence += 1
+            else:
+                busy -= 1
+
+    latencies.sort()
+    def pick(fraction: float) -> float:
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    return {
+        "admitted": len(latencies),
+        "shed": shed,
+        "goodput_rps": len(latencies) / clock.now,
+        "p50_ms": pick(0.50) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "p999_ms": pick(0.999) * 1000,
+        "mean_limit": sum(limit_samples) / len(limit_samples) if limit_samples else math.inf
+    }
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    print("=== Adaptive Concurrency Limiter ===\n")
+    limiter = AdaptiveConcurrencyLimiter(GradientLimit(initial=4))
+    with limiter.acquire():
+        print(f"sync permit held: {limiter.stats()}")
+
+    async def handler():
+        async with limiter.acquire():
+            await asyncio.sleep(0.01)
+
+    asyncio.run(handler())
+    print(f"after async permit: {limiter.stats()}")
+
+    # A release the clock measured as taking no time must not move the limit
+    instant = AdaptiveConcurrencyLimiter(GradientLimit(initial=4), clock=VirtualClock())
+    with instant.acquire():
+        pass
+    assert instant.limit == 4, instant.limit
+    print(f"zero-latency release: limit still {instant.stats()['limit']}")
+
+    print("\nOverload: 1200 req/s offered to a downstream that serves ~800 req/s")
+    configurations = {
+        "no limiter": None,
+        "AIMD": AdaptiveConcurrencyLimiter(AIMDLimit(latency_threshold=0.05)),
+        "gradient": AdaptiveConcurrencyLimiter(GradientLimit())
+    }
+    for name, candidate in configurations.items():
+        report = simulate_overload(candidate)
+        limit = f", mean limit {report['mean_limit']:.1f}" if candidate is not None else ""
+        print(f"{name:>10}: {report['goodput_rps']:,.0f} req/s served, {report['shed']:,} shed, "
+              f"latency p50 {report['p50_ms']:,.0f} ms / p99 {report['p99_ms']:,.0f} ms / "
+              f"p999 {report['p999_ms']:,.0f} ms{limit}")
@@ -0,0 +1,285 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from rate_limiter import RateLimitResponse, RateLimitResult, TokenBucket, _compile_key_spec
+
+
+class _LoopBucket(TokenBucket):
+    """
+    Token bucket owned by a single event loop
+
+    All access happens on the loop thread, so the threading lock is replaced
+    by a no-op context and TokenBucket's methods never block the loop.
+    Waiters queue in FIFO order and are woken by one timer per bucket,
+    scheduled for exactly when the head waiter's tokens will be available.
+    """
+
+    def __init__(self, capacity: int, refill_rate: float, clock: Callable[[], float]):
+        super().__init__(capacity, refill_rate, clock=clock)
+        self._lock = contextlib.nullcontext()
+        self.waiters: Deque[Tuple[asyncio.Future, int]] = deque()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def wake(self) -> None:
+        """Grant tokens to waiters at the head of the queue, then re-arm the timer"""
+        self.timer = None
+        waiters = self.waiters
+        while waiters:
+            future, tokens = waiters[0]
+            if future.done():
+                # Timed out or cancelled while queued
+                waiters.popleft()
+                continue
+            if not self.consume(tokens):
+                break
+            waiters.popleft()
+            future.set_result(True)
+        if waiters:
+            delay = self.time_until_tokens(waiters[0][1])
+            self.timer = asyncio.get_running_loop().call_later(delay, self.wake)
+
+
+class AsyncRateLimiter:
+    """
+    asyncio-native token bucket rate limiter
+
+    acquire() suspends the calling task until its tokens are available
+    instead of failing or busy-retrying. The sleep is computed from
+    time_until_tokens and handled by a per-bucket timer, so waiters on the
+    same client are served strictly in arrival order without polling.
+    Use one instance per event loop.
+
+    Token accounting reads the injected clock, but wake-ups and acquire()
+    timeouts are event loop timers, which run on the loop's own monotonic
+    clock. A custom clock must therefore advance in step with real time
+    (an offset or a different monotonic source is fine); a virtual clock
+    that only moves when told to will not wake waiters.
+    """
+
+    def __init__(self, default_capacity: int = 10, default_refill_rate: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the async rate limiter
+
+        Args:
+            default_capacity: Default bucket capacity for new clients
+            default_refill_rate: Default refill rate for new clients
+            clock: Monotonic time source in seconds, advancing at real-time
+                pace (see the class docstring)
+        """
+        self.default_capacity = default_capacity
+        self.default_refill_rate = default_refill_rate
+        self.clock = clock
+        self.buckets: Dict[str, _LoopBucket] = {}
+        self.request_counts: Dict[str, int] = {}
+
+    def _bucket_for(self, client_id: str, capacity: Optional[int],
+                    refill_rate: Optional[float]) -> _LoopBucket:
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = self.buckets[client_id] = _LoopBucket(
+                capacity or self.default_capacity,
+                refill_rate or self.default_refill_rate,
+                self.clock)
+        self.request_counts[client_id] = self.request_counts.get(client_id, 0) + 1
+        return bucket
+
+    def is_allowed(self, client_id: str, tokens: int = 1,
+                   capacity: Optional[int] = None,
+                   refill_rate: Optional[float] = None) -> RateLimitResponse:
+        """
+        Non-waiting check, same contract as RateLimiter.is_allowed
+
+        A request never jumps ahead of tasks already queued in acquire().
+        """
+        bucket = self._bucket_for(client_id, capacity, refill_rate)
+        total_requests = self.request_counts[client_id]
+        if not bucket.waiters:
+            allowed, remaining, _ = bucket.try_acquire(tokens)
+            if allowed:
+                return RateLimitResponse(
+                    result=RateLimitResult.ALLOWED,
+                    tokens_remaining=remaining,
+                    total_requests=total_requests
+                )
+        return RateLimitResponse(
+            result=RateLimitResult.RATE_LIMITED,
+            tokens_remaining=bucket.peek(),
+            retry_after_seconds=bucket.time_until_tokens(tokens),
+            total_requests=total_requests
+        )
+
+    async def acquire(self, client_id: str, tokens: int = 1,
+                      timeout: Optional[float] = None,
+                      capacity: Optional[int] = None,
+                      refill_rate: Optional[float] = None) -> RateLimitResponse:
+        """
+        Wait until tokens are available for client, then consume them
+
+        Args:
+            client_id: Unique identifier for the client
+            tokens: Number of tokens to consume
+            timeout: Maximum seconds to wait (None waits indefinitely)
+            capacity: Custom bucket capacity (optional)
+            refill_rate: Custom refill rate (optional)
+
+        Returns:
+            ALLOWED once the tokens were consumed, or RATE_LIMITED with
+            retry_after_seconds if the timeout expired first
+        """
+        bucket = self._bucket_for(client_id, capacity, refill_rate)
+        total_requests = self.request_counts[client_id]
+        if tokens > bucket.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket of capacity {bucket.capacity}")
+
+        if not bucket.waiters:
+            allowed, remaining, _ = bucket.try_acquire(tokens)
+            if allowed:
+                return RateLimitResponse(
+                    result=RateLimitResult.ALLOWED,
+                    tokens_remaining=remaining,
+                    total_requests=total_requests
+                )
+
+        future = asyncio.get_running_loop().create_future()
+        bucket.waiters.append((future, tokens))
+        if bucket.timer is None:
+            bucket.wake()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # Let the next waiter use the tokens this one was due
+            if bucket.timer is not None:
+                bucket.timer.cancel()
+            bucket.wake()
+            return RateLimitResponse(
+                result=RateLimitResult.RATE_LIMITED,
+                tokens_remaining=bucket.peek(),
+                retry_after_seconds=bucket.time_until_tokens(tokens),
+                total_requests=total_requests
+            )
+        return RateLimitResponse(
+            result=RateLimitResult.ALLOWED,
+            tokens_remaining=bucket.peek(),
+            total_requests=total_requests
+        )
+
+    def get_client_stats(self, client_id: str) -> Dict:
+        """Get statistics for a specific client"""
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            return {"error": "Client not found"}
+        return {
+            "client_id": client_id,
+            "tokens_available": bucket.peek(),
+            "bucket_capacity": bucket.capacity,
+            "refill_rate": bucket.refill_rate,
+            "total_requests": self.request_counts.get(client_id, 0),
+            "waiters": len(bucket.waiters)
+        }
+
+
+def async_rate_limit(capacity: int = 10, refill_rate: float = 1.0,
+                     key_func=None, limiter_instance=None,
+                     timeout: Optional[float] = None, key=None):
+    """
+    Decorator to add rate limiting to coroutine functions
+
+    Unlike rate_limit, the call waits for tokens (up to `timeout`) instead
+    of raising immediately.
+
+    Args:
+        capacity: Token bucket capacity
+        refill_rate: Tokens per second
+        key_func: Function to generate client key (defaults to using arguments)
+        limiter_instance: Existing AsyncRateLimiter instance (creates new if None)
+        timeout: Maximum seconds to wait for tokens (None waits indefinitely)
+        key: Declarative key spec instead of key_func: a positional index,
+            a parameter name, or a tuple of those (e.g. "user_id")
+    """
+    if limiter_instance is None:
+        limiter_instance = AsyncRateLimiter(capacity, refill_rate)
+    if key is not None and key_func is not None:
+        raise ValueError("Pass either key or key_func, not both")
+
+    def decorator(func):
+        if not inspect.iscoroutinefunction(func):
+            raise TypeError(f"async_rate_limit requires a coroutine function, got {func!r}")
+        prefix = f"{func.__name__}_"
+        accessor = _compile_key_spec(func, key) if key is not None else None
+
+        # Same key value -> same client key string, built once, as in rate_limit
+        @functools.lru_cache(maxsize=4096)
+        def client_key_for(value) -> str:
+            return prefix + str(value)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # Generate client key
+            if accessor is not None:
+                value = accessor(args, kwargs)
+                try:
+                    client_key = client_key_for(value)
+                except TypeError:  # unhashable key value
+                    client_key = prefix + str(value)
+            elif key_func:
+                client_key = key_func(*args, **kwargs)
+            else:
+                try:
+                    client_key = client_key_for(hash((args, tuple(sorted(kwargs.items())))))
+                except TypeError:  # unhashable arguments
+                    client_key = f"{prefix}{hash(str(args) + str(sorted(kwargs.items())))}"
+
+            result = await limiter_instance.acquire(client_key, timeout=timeout)
+
+            if result.result == RateLimitResult.RATE_LIMITED:
+                raise Exception(f"Rate limit exceeded. Retry after {result.retry_after_seconds:.2f} seconds")
+
+            return await func(*args, **kwargs)
+
+        wrapper.limiter = limiter_instance
+        return wrapper
+    return decorator
+
+
+# Example of decorator usage
+@async_rate_limit(capacity=3, refill_rate=5.0, key="user_id")
+async def async_api_call(user_id: str, data: str):
+    """Simulated async API call with rate limiting"""
+    return f"Processing {data} for user {user_id}"
+
+
+async def demonstrate_async_rate_limiter():
+    """Demonstrate waiting acquisition, FIFO wake-ups and timeouts"""
+    print("=== Async Token Bucket Rate Limiter Demo ===\n")
+
+    limiter = AsyncRateLimiter(default_capacity=2, default_refill_rate=4.0)
+    start = time.monotonic()
+    order = []
+
+    async def request(n: int):
+        await limiter.acquire("user_123")
+        order.append(n)
+        print(f"Request {n} admitted after {time.monotonic() - start:.2f}s")
+
+    print("1. Six concurrent requests, burst of 2 then 4 per second...")
+    await asyncio.gather(*(request(n) for n in range(6)))
+    print(f"Admission order: {order}")
+
+    print("\n2. Timeout while waiting...")
+    result = await limiter.acquire("user_123", tokens=2, timeout=0.1)
+    print(f"{result.result.value}, retry after {result.retry_after_seconds:.2f}s")
+
+    print("\n3. Async decorator...")
+    results = await asyncio.gather(*(async_api_call("user123", f"request_{i}") for i in range(5)))
+    for line in results:
+        print(f"✓ {line} ({time.monotonic() - start:.2f}s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(demonstrate_async_rate_limiter())
@@ -0,0 +1,413 @@
+"""
+Rate-limit decision service over TCP
+
+Lets many small services share one RateLimiter. The wire protocol is
+length-prefixed binary frames (little-endian):
+
+    frame     u32 payload length | payload
+    request   u32 request id | u16 count | count x (u32 tokens | u16 key length | key UTF-8)
+    response  u32 request id | u16 count | count x (u8 allowed | u32 tokens remaining |
+                                                    f64 retry after | u64 total requests)
+
+A frame carries a batch of decisions, answered by the server in one
+RateLimiter.is_allowed_many call. Clients may pipeline: send any number
+of frames without waiting, and match responses by request id.
+
+RateLimitClient keeps a small pool of pipelined connections and
+coalesces concurrent is_allowed() calls made in the same event-loop
+iteration into one frame, so a busy caller pays one round trip and one
+syscall per batch rather than per decision.
+"""
+import asyncio
+import itertools
+import struct
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from rate_limiter import RateLimiter, RateLimitResponse, RateLimitResult
+
+FRAME = struct.Struct("<I")
+BATCH = struct.Struct("<IH")
+DECISION = struct.Struct("<IH")  # tokens, key length (key bytes follow)
+VERDICT = struct.Struct("<BIdQ")
+MAX_BATCH = 0xFFFF
+MAX_FRAME = 1 << 20  # default cap on a request frame the server will buffer
+
+
+class ProtocolError(ValueError):
+    """A peer sent a frame that does not follow the protocol"""
+
+
+def encode_request(request_id: int, requests: Sequence[Tuple[str, int]]) -> bytes:
+    parts = [b"", BATCH.pack(request_id, len(requests))]
+    for client_id, tokens in requests:
+        key = client_id.encode()
+        parts.append(DECISION.pack(tokens, len(key)))
+        parts.append(key)
+    parts[0] = FRAME.pack(sum(map(len, parts)))
+    return b"".join(parts)
+
+
+def decode_request(payload: bytes) -> Tuple[int, List[Tuple[str, int]]]:
+    request_id, count = BATCH.unpack_from(payload, 0)
+    offset = BATCH.size
+    requests = []
+    for _ in range(count):
+        tokens, length = DECISION.unpack_from(payload, offset)
+        offset += DECISION.size
+        if offset + length > len(payload):
+            raise ProtocolError("Decision key runs past the end of the frame")
+        requests.append((payload[offset:offset + length].decode(), tokens))
+        offset += length
+    return request_id, requests
+
+
+def encode_response(request_id: int, responses: Sequence[RateLimitResponse]) -> bytes:
+    body = bytearray(FRAME.size + BATCH.size + VERDICT.size * len(responses))
+    FRAME.pack_into(body, 0, len(body) - FRAME.size)
+    BATCH.pack_into(body, FRAME.size, request_id, len(responses))
+    offset = FRAME.size + BATCH.size
+    allowed = RateLimitResult.ALLOWED
+    for response in responses:
+        VERDICT.pack_into(body, offset, response.result == allowed, response.tokens_remaining,
+                          response.retry_after_seconds or 0.0, response.total_requests)
+        offset += VERDICT.size
+    return bytes(body)
+
+
+def decode_response(payload: bytes) -> Tuple[int, List[RateLimitResponse]]:
+    request_id, count = BATCH.unpack_from(payload, 0)
+    responses = []
+    for allowed, remaining, retry_after, total in VERDICT.iter_unpack(payload[BATCH.size:]):
+        if allowed:
+            responses.append(RateLimitResponse(RateLimitResult.ALLOWED, remaining, None, total))
+        else:
+            responses.append(RateLimitResponse(RateLimitResult.RATE_LIMITED, remaining, retry_after, total))
+    return request_id, responses
+
+
+class RateLimitServer:
+    """
+    asyncio TCP server answering decision batches from a RateLimiter
+
+    Decisions run on the event loop thread; they are in-memory and far
+    cheaper than the socket I/O around them. Writes are only awaited
+    (drained) once the transport buffer passes its high-water mark, so a
+    pipelining client is not throttled to one frame per round trip.
+
+    A frame longer than `max_frame` bytes, or one that does not decode,
+    is a protocol error: the connection is closed without a response.
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None,
+                 host: str = "127.0.0.1", port: int = 0, max_frame: int = MAX_FRAME):
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.host = host
+        self.port = port
+        self.max_frame = max_frame
+        self.decisions = 0
+        self.frames = 0
+        self.protocol_errors = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self) -> "RateLimitServer":
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handler = asyncio.current_task()
+        self._handlers[handler] = writer
+        is_allowed_many = self.limiter.is_allowed_many
+        transport = writer.transport
+        try:
+            while True:
+                header = await reader.readexactly(FRAME.size)
+                length = FRAME.unpack(header)[0]
+                if length > self.max_frame:
+                    raise ProtocolError(f"Frame of {length} bytes exceeds {self.max_frame}")
+                payload = await reader.readexactly(length)
+                try:
+                    request_id, requests = decode_request(payload)
+                except (struct.error, UnicodeDecodeError) as exc:
+                    raise ProtocolError(f"Malformed request frame: {exc}") from exc
+                writer.write(encode_response(request_id, is_allowed_many(requests)))
+                self.frames += 1
+                self.decisions += len(requests)
+                if transport.get_write_buffer_size() > 1 << 16:
+                    await writer.drain()
+        except ProtocolError:
+            self.protocol_errors += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.pop(handler, None)
+
+    async def close(self, grace: float = 1.0) -> None:
+        """
+        Stop accepting connections, give open ones `grace` seconds to hang
+        up, then close the rest
+        """
+        self._server.close()
+        if self._handlers:
+            _, lingering = await asyncio.wait(set(self._handlers), timeout=grace)
+            for handler in lingering:
+                # Closing the transport ends the handler's pending read
+                writer = self._handlers.get(handler)
+                if writer is not None:
+                    writer.close()
+            if lingering:
+                await asyncio.wait(lingering)
+        await self._server.wait_closed()
+
+
+class _Connection:
+    """
+    One pipelined connection: pending futures keyed by request id
+
+    `closed` is set once the response reader stops; the client then
+    replaces the connection instead of writing to a dead transport. With
+    a timeout, a watchdog task fails frames left unanswered for longer
+    (checked every timeout / 4, so a call may wait up to 25% more); one
+    deque append per frame is cheaper than a wait_for per call.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.deadlines: Deque[Tuple[float, int]] = deque()  # (deadline, request id) in send order
+        self.batch: List[Tuple[str, int]] = []
+        self.batch_futures: List[asyncio.Future] = []
+        self.flush_scheduled = False
+        self.closed = False
+        self.reader_task = loop.create_task(self._read_responses())
+        self.watchdog = loop.create_task(self._expire_overdue()) if timeout is not None else None
+
+    def track(self, request_id: int, future: asyncio.Future) -> None:
+        self.pending[request_id] = future
+        if self.timeout is not None:
+            self.deadlines.append((asyncio.get_running_loop().time() + self.timeout, request_id))
+
+    async def _expire_overdue(self) -> None:
+        loop = asyncio.get_running_loop()
+        deadlines = self.deadlines
+        while True:
+            await asyncio.sleep(self.timeout / 4)
+            now = loop.time()
+            while deadlines and deadlines[0][0] <= now:
+                _, request_id = deadlines.popleft()
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_exception(asyncio.TimeoutError(
+                        f"No rate limit decision within {self.timeout} s"))
+
+    async def _read_responses(self) -> None:
+        error: BaseException = ConnectionError("Rate limit server connection closed")
+        try:
+            while True:
+                header = await self.reader.readexactly(FRAME.size)
+                payload = await self.reader.readexactly(FRAME.unpack(header)[0])
+                request_id, responses = decode_response(payload)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(responses)
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error) as exc:
+            error = ConnectionError(f"Rate limit server connection lost: {exc}")
+        finally:
+            self.closed = True
+            self.writer.close()
+            if self.watchdog is not None:
+                self.watchdog.cancel()
+            self.fail_pending(error)
+
+    def fail_pending(self, error: BaseException) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+
+class RateLimitClient:
+    """
+    Pooled, pipelining client for RateLimitServer
+
+    Calls are spread round robin over `pool_size` connections. Each
+    connection carries many outstanding frames at once, and is_allowed()
+    calls arriving in the same event-loop iteration share one frame.
+    A connection the server dropped fails its outstanding calls with
+    ConnectionError and is reopened for the next call that picks it;
+    calls not answered within `timeout` seconds raise
+    asyncio.TimeoutError.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, pool_size: int = 4,
+                 timeout: Optional[float] = 5.0):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._connections: List[_Connection] = []
+        self._next_connection = itertools.cycle(range(pool_size))
+        self._request_ids = itertools.count(1)
+
+    async def _open(self) -> _Connection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return _Connection(reader, writer, self.timeout)
+
+    async def connect(self) -> "RateLimitClient":
+        for _ in range(self.pool_size):
+            self._connections.append(await self._open())
+        return self
+
+    async def _reopen(self, index: int) -> _Connection:
+        """Replace pooled connection `index`, which the server dropped"""
+        replacement = await self._open()
+        connection = self._connections[index]
+        if not connection.closed:
+            # Another call reopened it meanwhile
+            replacement.writer.close()
+            return connection
+        self._connections[index] = replacement
+        return replacement
+
+    def _send(self, connection: _Connection, requests: Sequence[Tuple[str, int]]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if connection.closed or connection.writer.is_closing():
+            future.set_exception(ConnectionError("Rate limit server connection lost"))
+            return future
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        connection.track(request_id, future)
+        connection.writer.write(encode_request(request_id, requests))
+        return future
+
+    async def is_allowed_many(self, requests: Sequence[Tuple[str, int]]) -> List[RateLimitResponse]:
+        """Decide an explicit batch in one frame (split if over 65535 decisions)"""
+        index = next(self._next_connection)
+        connection = self._connections[index]
+        if connection.closed:
+            connection = await self._reopen(index)
+        futures = [self._send(connection, requests[i:i + MAX_BATCH])
+                   for i in range(0, len(requests), MAX_BATCH)]
+        drain = connection.writer.drain()
+        await (drain if self.timeout is None else asyncio.wait_for(drain, self.timeout))
+        responses: List[RateLimitResponse] = []
+        for future in futures:
+            responses.extend(await future)
+        return responses
+
+    async def is_allowed(self, client_id: str, tokens: int = 1) -> RateLimitResponse:
+        """Decide one request, coalesced with concurrent calls into one frame"""
+        index = next(self._next_connection)
+        connection = self._connections[index]
+        if connection.closed:
+            connection = await self._reopen(index)
+        future = asyncio.get_running_loop().create_future()
+        connection.batch.append((client_id, tokens))
+        connection.batch_futures.append(future)
+        if not connection.flush_scheduled:
+            connection.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush, connection)
+        return await future
+
+    def _flush(self, connection: _Connection) -> None:
+        connection.flush_scheduled = False
+        batch, futures = connection.batch, connection.batch_futures
+        connection.batch, connection.batch_futures = [], []
+        for start in range(0, len(batch), MAX_BATCH):
+            sent = self._send(connection, batch[start:start + MAX_BATCH])
+            sent.add_done_callback(
+                lambda done, waiting=futures[start:start + MAX_BATCH]: self._deliver(done, waiting))
+
+    @staticmethod
+    def _deliver(done: asyncio.Future, waiting: List[asyncio.Future]) -> None:
+        if done.exception() is not None:
+            for future in waiting:
+                if not future.done():
+                    future.set_exception(done.exception())
+            return
+        for future, response in zip(waiting, done.result()):
+            if not future.done():
+                future.set_result(response)
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            connection.writer.close()
+            try:
+                await connection.writer.wait_closed()
+            except ConnectionError:
+                pass  # already reset by the server
+            await connection.reader_task
+        self._connections.clear()
+
+
+async def load_test(mode: str, decisions: int = 50_000, concurrency: int = 64,
+                    batch_size: int = 100, clients: int = 10_000,
+                    pool_size: int = 4) -> Dict[str, float]:
+    """
+    Drive a loopback server and measure decisions/s and latency
+
+    Modes:
+        sequential: one is_allowed() at a time (a round trip per decision)
+        pipelined: `concurrency` tasks calling is_allowed() concurrently
+        batched: is_allowed_many() with `batch_size` decisions per call
+    """
+    server = await RateLimitServer(RateLimiter(default_capacity=1_000, default_refill_rate=1_000.0,
+                                               store="compact")).start()
+    client = await RateLimitClient(port=server.port, pool_size=pool_size).connect()
+    ids = [f"client_{i}" for i in range(clients)]
+    latencies: List[float] = []
+    now = time.perf_counter
+
+    async def single(count: int, offset: int) -> None:
+        for i in range(count):
+            began = now()
+            await client.is_allowed(ids[(offset + i) % clients])
+            latencies.append(now() - began)
+
+    async def batches(count: int) -> None:
+        for start in range(0, count, batch_size):
+            batch = [(ids[i % clients], 1) for i in range(start, min(count, start + batch_size))]
+            began = now()
+            await client.is_allowed_many(batch)
+            elapsed = now() - began
+            # Per-decision cost of the batch
+            latencies.extend([elapsed / len(batch)] * len(batch))
+
+    began = now()
+    if mode == "sequential":
+        await single(decisions, 0)
+    elif mode == "pipelined":
+        per_task = decisions // concurrency
+        await asyncio.gather(*(single(per_task, t * per_task) for t in range(concurrency)))
+    elif mode == "batched":
+        await batches(decisions)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    elapsed = now() - began
+    await client.close()
+    await server.close()
+
+    latencies.sort()
+    return {
+        "decisions_per_second": len(latencies) / elapsed,
+        "p50_us": latencies[len(latencies) // 2] * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99)] * 1e6,
+        "frames": server.frames
+    }
+
+
+if __name__ == "__main__":
+    print("=== Rate Limit Decision Service (loopback) ===\n")
+    for mode in ("sequential", "pipelined", "batched"):
+        report = asyncio.run(load_test(mode))
+        label = "latency/decision" if mode == "batched" else "latency"
+        print(f"{mode:>10}: {report['decisions_per_second']:>9,.0f} decisions/s, {label} "
+              f"p50 {report['p50_us']:,.0f} us / p99 {report['p99_us']:,.0f} us, "
+              f"{report['frames']:,} frames")
@@ -0,0 +1,284 @@
+"""
+Benchmark suite for the rate limiters in rate_limiter.py
+
+Reports decisions per second and p50/p99/p999 decision latency for
+TokenBucket, RateLimiter (each store/algorithm), SlidingWindowCounter and
+the rate_limit decorator across thread counts, client-key cardinalities,
+uniform and Zipf-skewed client mixes, and steady or bursty arrivals.
+
+Every scenario runs on a VirtualClock and a seeded RNG, so the sequence of
+decisions is identical between runs (thread interleaving aside) and only
+the timings change. Results can be saved as a JSON baseline and compared
+against on the next run:
+
+    python rate_limiter_benchmark.py --save baseline.json
+    python rate_limiter_benchmark.py --compare baseline.json
+
+--components runs the focused benchmark_* functions of rate_limiter.py
+instead (memory per client, GCRA at 1M clients, sketch accuracy, decision
+path, sharding, decorator overhead); they take a few minutes.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from rate_limiter import (RateLimiter, SlidingWindowCounter, TokenBucket, VirtualClock, benchmark_decision_path,
+                          benchmark_decorator_overhead, benchmark_gcra_vs_token_bucket, benchmark_memory_per_client,
+                          benchmark_sharded_throughput, benchmark_sketch_accuracy, rate_limit)
+
+
+@dataclass
+class Scenario:
+    """One benchmark configuration"""
+    name: str
+    target: str  # token_bucket, limiter, compact, gcra, sketch, sliding_window, decorator
+    ops: int = 100_000
+    threads: int = 1
+    clients: int = 1_000
+    distribution: str = "uniform"  # uniform or zipf
+    pattern: str = "steady"  # steady or burst
+    zipf_s: float = 1.1
+    seed: int = 42
+
+
+@dataclass
+class Result:
+    """Measured throughput and latency for one scenario"""
+    ops_per_second: float
+    p50_us: float
+    p99_us: float
+    p999_us: float
+
+
+def zipf_indices(rng: random.Random, clients: int, count: int, s: float) -> List[int]:
+    """
+    Sample client indices with P(k) roughly proportional to 1 / k^s
+
+    Uses the inverse CDF of the continuous power law, so sampling stays
+    O(1) per draw and needs no weight table even for 10M clients.
+    """
+    if clients == 1:
+        return [0] * count
+    if abs(s - 1.0) < 1e-9:
+        return [min(clients - 1, int(clients ** rng.random()) - 1) for _ in range(count)]
+    a = 1.0 - s
+    top = clients ** a - 1.0
+    return [min(clients - 1, int((top * rng.random() + 1.0) ** (1.0 / a)) - 1) for _ in range(count)]
+
+
+def make_workload(scenario: Scenario):
+    """Client ids and per-op clock steps for a scenario"""
+    rng = random.Random(scenario.seed)
+    if scenario.distribution == "zipf":
+        indices = zipf_indices(rng, scenario.clients, scenario.ops, scenario.zipf_s)
+    else:
+        indices = [rng.randrange(scenario.clients) for _ in range(scenario.ops)]
+    ids = [f"client_{i}" for i in indices]
+
+    if scenario.pattern == "burst":
+        # Bursts of 50 back-to-back requests separated by 2s of silence
+        steps = [2.0 if i % 50 == 0 else 0.0 for i in range(scenario.ops)]
+    else:
+        steps = [0.001] * scenario.ops
+    return ids, steps
+
+
+def make_decision(scenario: Scenario, clock: VirtualClock) -> Callable[[str], object]:
+    """Build the function under test for a scenario's target"""
+    target = scenario.target
+    if target == "token_bucket":
+        bucket = TokenBucket(capacity=100, refill_rate=50.0, clock=clock)
+        return lambda client_id: bucket.try_acquire(1)
+    if target in ("limiter", "compact", "gcra", "sketch"):
+        options = {"store": "compact"} if target == "compact" else \
+            {"algorithm": target} if target in ("gcra", "sketch") else {}
+        limiter = RateLimiter(default_capacity=10, default_refill_rate=5.0,
+                              shards=16 if scenario.threads > 1 else 1, clock=clock, **options)
+        return limiter.is_allowed
+    if target == "sliding_window":
+        window = SlidingWindowCounter(limit=10, window_seconds=10, clock=clock)
+        return window.is_allowed
+    if target == "decorator":
+        limiter = RateLimiter(default_capacity=10, default_refill_rate=5.0, clock=clock)
+
+        @rate_limit(limiter_instance=limiter, key="user_id")
+        def handler(user_id):
+            return user_id
+
+        def call(client_id):
+            try:
+                handler(client_id)
+            except Exception:
+                pass
+        return call
+    raise ValueError(f"Unknown target: {target}")
+
+
+def percentile(sorted_values: List[int], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def run_scenario(scenario: Scenario) -> Result:
+    """Run one scenario and summarize its timings"""
+    clock = VirtualClock()
+    decide = make_decision(scenario, clock)
+    ids, steps = make_workload(scenario)
+
+    per_thread = scenario.ops // scenario.threads
+    latencies: List[List[int]] = [[] for _ in range(scenario.threads)]
+    barrier = threading.Barrier(scenario.threads + 1)
+
+    def worker(t: int):
+        lo = t * per_thread
+        ids_slice = ids[lo:lo + per_thread]
+        steps_slice = steps[lo:lo + per_thread]
+        record = latencies[t].append
+        now = time.perf_counter_ns
+        barrier.wait()
+        for client_id, step in zip(ids_slice, steps_slice):
+            if step:
+                clock.advance(step / scenario.threads)
+            began = now()
+            decide(client_id)
+            record(now() - began)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(scenario.threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    merged = sorted(value for values in latencies for value in values)
+    return Result(
+        ops_per_second=len(merged) / elapsed,
+        p50_us=percentile(merged, 0.50) / 1000,
+        p99_us=percentile(merged, 0.99) / 1000,
+        p999_us=percentile(merged, 0.999) / 1000
+    )
+
+
+def default_scenarios(full: bool = False) -> List[Scenario]:
+    """The standard matrix; `full` adds the 10M-client and 64-thread corners"""
+    scenarios = [Scenario("token_bucket/single", "token_bucket", clients=1)]
+    for target in ("limiter", "compact", "gcra", "sketch", "sliding_window", "decorator"):
+        scenarios.append(Scenario(f"{target}/1k/uniform", target))
+        scenarios.append(Scenario(f"{target}/100k/zipf", target, clients=100_000, distribution="zipf"))
+        scenarios.append(Scenario(f"{target}/1k/burst", target, pattern="burst"))
+    for threads in (1, 4, 16) + ((64,) if full else ()):
+        scenarios.append(Scenario(f"limiter/threads={threads}", "limiter", threads=threads,
+                                  clients=10_000, distribution="zipf"))
+    scenarios.append(Scenario("limiter/1/hot-key", "limiter", clients=1))
+    if full:
+        for target in ("limiter", "compact", "gcra", "sketch"):
+            scenarios.append(Scenario(f"{target}/10M/uniform", target, ops=500_000, clients=10_000_000))
+            scenarios.append(Scenario(f"{target}/10M/zipf", target, ops=500_000, clients=10_000_000,
+                                      distribution="zipf"))
+    return scenarios
+
+
+def compare(results: Dict[str, Result], baseline: Dict, tolerance: float) -> List[str]:
+    """Scenarios whose throughput fell more than `tolerance` below the baseline"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        ratio = result.ops_per_second / previous["ops_per_second"]
+        if ratio < 1.0 - tolerance:
+            regressions.append(f"{name}: {ratio:.2f}x baseline throughput "
+                               f"(p99 {previous['p99_us']:.1f} -> {result.p99_us:.1f} us)")
+    return regressions
+
+
+def run_components() -> None:
+    """Print the results of the focused benchmark_* functions in rate_limiter.py"""
+    print("=== Decorator Overhead per Call ===")
+    for variant, micros in benchmark_decorator_overhead().items():
+        print(f"{variant:>17}: {micros:.2f} µs")
+
+    print("\n=== Memory per Client ===")
+    for store, per_client in benchmark_memory_per_client().items():
+        print(f"{store:>8} store: {per_client:,.0f} bytes/client")
+
+    print("\n=== GCRA vs Token Bucket (1M clients) ===")
+    for name, figures in benchmark_gcra_vs_token_bucket().items():
+        print(f"{name:>21}: {figures['bytes_per_client']:,.0f} bytes/client, "
+              f"{figures['ops_per_second']:,.0f} ops/s")
+
+    print("\n=== Count-Min Sketch Limiter (fixed memory) ===")
+    report = benchmark_sketch_accuracy()
+    print(f"{report['distinct_clients']:,} distinct clients in {report['sketch_bytes'] / 2**20:.1f} MiB: "
+          f"{report['false_rejection_rate']:.4%} false rejections, "
+          f"{report['over_admissions']} over-admissions, {report['ops_per_second']:,.0f} ops/s")
+
+    print("\n=== Decision Path Benchmark (virtual clock) ===")
+    print(f"{benchmark_decision_path():,.0f} decisions/s")
+
+    print("\n=== Sharded Throughput Benchmark ===")
+    for shard_count, by_threads in benchmark_sharded_throughput().items():
+        row = ", ".join(f"{t} threads: {ops:,.0f} ops/s" for t, ops in by_threads.items())
+        print(f"{shard_count:>3} shards -> {row}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--full", action="store_true", help="include 10M-client and 64-thread scenarios")
+    parser.add_argument("--components", action="store_true",
+                        help="run the focused benchmarks from rate_limiter.py instead of the scenario matrix")
+    parser.add_argument("--filter", default="", help="only run scenarios whose name contains this")
+    parser.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed throughput drop before flagging a regression (default 0.10)")
+    args = parser.parse_args(argv)
+    if args.components:
+        run_components()
+        return 0
+
+    results: Dict[str, Result] = {}
+    print(f"{'scenario':<32}{'ops/s':>12}{'p50 us':>9}{'p99 us':>9}{'p999 us':>9}")
+    for scenario in default_scenarios(args.full):
+        if args.filter not in scenario.name:
+            continue
+        result = results[scenario.name] = run_scenario(scenario)
+        print(f"{scenario.name:<32}{result.ops_per_second:>12,.0f}{result.p50_us:>9.2f}"
+              f"{result.p99_us:>9.2f}{result.p999_us:>9.2f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "implementation": platform.python_implementation(),
+                    "machine": platform.machine(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "results": {name: asdict(result) for name, result in results.items()}
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
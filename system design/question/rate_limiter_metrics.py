@@ -0,0 +1,248 @@
+import bisect
+import heapq
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from rate_limiter import RateLimiter, RateLimitResponse, RateLimitResult
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter sketch (Metwally et al.)
+
+    Tracks at most `capacity` items. A new item arriving when the table is
+    full replaces the item with the smallest count and inherits that count
+    (recorded as its error bound). Any item whose true frequency exceeds
+    N / capacity is guaranteed to be present, and every reported count
+    overestimates the truth by at most its error.
+
+    The minimum is found through a lazily maintained heap: stale entries
+    are skipped when popped and the heap is rebuilt when it grows too
+    large, so updates are O(log k) amortized.
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, item: str, count: int = 1) -> None:
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim, floor = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self._heap, (counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, i) for i, c in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[str, int]:
+        heap = self._heap
+        while True:
+            count, item = heapq.heappop(heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def top(self, k: int) -> List[Tuple[str, int, int]]:
+        """The k heaviest items as (item, estimated_count, max_overestimate)"""
+        ranked = heapq.nlargest(k, self.counts.items(), key=lambda pair: pair[1])
+        return [(item, count, self.errors[item]) for item, count in ranked]
+
+
+class _ThreadMetrics:
+    """Counters owned by one thread; only that thread writes them"""
+
+    __slots__ = ("allowed", "limited", "buckets", "latency_sum")
+
+    def __init__(self, bucket_count: int):
+        self.allowed = 0
+        self.limited = 0
+        self.buckets = [0] * bucket_count
+        self.latency_sum = 0.0
+
+
+class InstrumentedRateLimiter:
+    """
+    RateLimiter wrapper that records decision metrics
+
+    Counts allowed/limited decisions, keeps a decision-latency histogram
+    and tracks the most frequently rate-limited clients with a
+    Space-Saving sketch, so heavy hitters can be found during an incident
+    without walking every bucket.
+
+    Counters and histograms are per thread and written without locks;
+    a snapshot sums them while is_allowed keeps running. Only rejected
+    decisions touch the shared sketch, under its own short lock. Both
+    decision methods, is_allowed and is_allowed_many, are recorded; any
+    other attribute is forwarded to the wrapped limiter.
+    """
+
+    # Histogram upper bounds in seconds (Prometheus `le` labels)
+    LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, top_k: int = 100):
+        """
+        Wrap a limiter with metrics
+
+        Args:
+            limiter: RateLimiter to instrument (a default one if None)
+            top_k: Number of rate-limited clients the sketch tracks
+        """
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.heavy_hitters = SpaceSaving(top_k)
+        self._sketch_lock = threading.Lock()
+        self._local = threading.local()
+        self._registry: List[_ThreadMetrics] = []
+        self._registry_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.limiter, name)
+
+    def _metrics(self) -> _ThreadMetrics:
+        metrics = getattr(self._local, "metrics", None)
+        if metrics is None:
+            metrics = self._local.metrics = _ThreadMetrics(len(self.LATENCY_BUCKETS) + 1)
+            with self._registry_lock:
+                self._registry.append(metrics)
+        return metrics
+
+    def is_allowed(self, client_id: str, tokens: int = 1,
+                   capacity: Optional[int] = None,
+                   refill_rate: Optional[float] = None) -> RateLimitResponse:
+        """Same as RateLimiter.is_allowed, with the decision recorded"""
+        began = time.perf_counter()
+        response = self.limiter.is_allowed(client_id, tokens, capacity, refill_rate)
+        elapsed = time.perf_counter() - began
+
+        metrics = self._metrics()
+        metrics.buckets[bisect.bisect_left(self.LATENCY_BUCKETS, elapsed)] += 1
+        metrics.latency_sum += elapsed
+        if response.result == RateLimitResult.ALLOWED:
+            metrics.allowed += 1
+        else:
+            metrics.limited += 1
+            with self._sketch_lock:
+                self.heavy_hitters.add(client_id)
+        return response
+
+    def is_allowed_many(self, requests: Iterable[Tuple[str, int]]) -> List[RateLimitResponse]:
+        """
+        Same as RateLimiter.is_allowed_many, with every decision recorded
+
+        Each decision in the batch is recorded with an equal share of the
+        batch's latency, so the histogram stays per decision.
+        """
+        requests = list(requests)
+        began = time.perf_counter()
+        responses = self.limiter.is_allowed_many(requests)
+        elapsed = time.perf_counter() - began
+        if not responses:
+            return responses
+
+        metrics = self._metrics()
+        share = elapsed / len(responses)
+        metrics.buckets[bisect.bisect_left(self.LATENCY_BUCKETS, share)] += len(responses)
+        metrics.latency_sum += elapsed
+        limited = [client_id for (client_id, _), response in zip(requests, responses)
+                   if response.result != RateLimitResult.ALLOWED]
+        metrics.allowed += len(responses) - len(limited)
+        metrics.limited += len(limited)
+        if limited:
+            with self._sketch_lock:
+                for client_id in limited:
+                    self.heavy_hitters.add(client_id)
+        return responses
+
+    def snapshot(self, top_k: int = 10) -> Dict:
+        """Point-in-time totals across all threads plus the top rate-limited clients"""
+        with self._registry_lock:
+            registry = list(self._registry)
+        buckets = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        allowed = limited = 0
+        latency_sum = 0.0
+        for metrics in registry:
+            allowed += metrics.allowed
+            limited += metrics.limited
+            latency_sum += metrics.latency_sum
+            for i, count in enumerate(metrics.buckets):
+                buckets[i] += count
+        with self._sketch_lock:
+            top = self.heavy_hitters.top(top_k)
+        return {
+            "allowed": allowed,
+            "rate_limited": limited,
+            "latency_buckets": dict(zip(self.LATENCY_BUCKETS + (float("inf"),), buckets)),
+            "latency_sum_seconds": latency_sum,
+            "top_limited_clients": top
+        }
+
+    def export_prometheus(self, prefix: str = "rate_limiter", top_k: int = 10) -> str:
+        """Render a snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot(top_k)
+        lines = [
+            f"# HELP {prefix}_decisions_total Rate limit decisions by result",
+            f"# TYPE {prefix}_decisions_total counter",
+            f'{prefix}_decisions_total{{result="allowed"}} {snap["allowed"]}',
+            f'{prefix}_decisions_total{{result="rate_limited"}} {snap["rate_limited"]}',
+            f"# HELP {prefix}_decision_latency_seconds Time spent in is_allowed",
+            f"# TYPE {prefix}_decision_latency_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in snap["latency_buckets"].items():
+            cumulative += count
+            label = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{prefix}_decision_latency_seconds_bucket{{le="{label}"}} {cumulative}')
+        lines.append(f"{prefix}_decision_latency_seconds_sum {snap['latency_sum_seconds']!r}")
+        lines.append(f"{prefix}_decision_latency_seconds_count {cumulative}")
+        lines.append(f"# HELP {prefix}_top_limited_requests Estimated rejections for the heaviest clients")
+        lines.append(f"# TYPE {prefix}_top_limited_requests gauge")
+        for client_id, count, _ in snap["top_limited_clients"]:
+            lines.append(f'{prefix}_top_limited_requests{{client_id="{_escape_label(client_id)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+if __name__ == "__main__":
+    import random
+
+    print("=== Rate Limiter Metrics Demo ===\n")
+    limiter = InstrumentedRateLimiter(RateLimiter(default_capacity=5, default_refill_rate=1.0), top_k=20)
+    rng = random.Random(1)
+    # A few abusive clients among many well-behaved ones
+    clients = [f"ip_10.0.0.{i}" for i in range(3)] * 200 + [f"ip_192.168.{i // 256}.{i % 256}" for i in range(2_000)]
+    rng.shuffle(clients)
+
+    def traffic(chunk):
+        for client_id in chunk:
+            limiter.is_allowed(client_id)
+
+    threads = [threading.Thread(target=traffic, args=(clients[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(limiter.export_prometheus(top_k=5))
+
+    # Batch decisions are counted like single ones
+    before = limiter.snapshot()
+    batch = limiter.is_allowed_many([("ip_10.0.0.0", 1)] * 50 + [("ip_172.16.0.1", 1)] * 3)
+    after = limiter.snapshot(top_k=1)
+    assert after["allowed"] - before["allowed"] == sum(r.result == RateLimitResult.ALLOWED for r in batch)
+    assert (after["allowed"] + after["rate_limited"]) - (before["allowed"] + before["rate_limited"]) == 53
+    assert after["top_limited_clients"][0][0] == "ip_10.0.0.0"
+    assert f'result="rate_limited"}} {after["rate_limited"]}' in limiter.export_prometheus()
+    print(f"After a batch of 53: {after['allowed']:,} allowed, {after['rate_limited']:,} rate limited")
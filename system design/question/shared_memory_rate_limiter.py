@@ -0,0 +1,270 @@
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+from rate_limiter import RateLimitResponse, RateLimitResult
+
+
+class SharedMemoryRateLimiter:
+    """
+    Token bucket rate limiter shared by every process on a host
+
+    With N pre-forked workers each holding its own RateLimiter, a client
+    effectively gets N times its limit. Here the bucket table lives in a
+    multiprocessing.shared_memory block, so all workers draw from the same
+    buckets with no network hop.
+
+    Layout: a small header (slot count, capacity, refill rate) followed by
+    four columns of `slots` entries each:
+    - key: 64-bit BLAKE2b fingerprint of the client id (0 = empty slot)
+    - tokens, last_refill: token bucket state (float64)
+    - requests: request count (uint64)
+
+    Clients are placed by open addressing with linear probing. Slots are
+    never deleted, so a probe sequence stays valid without tombstones;
+    when the table is full, new clients are rejected with RuntimeError.
+    Each slot is guarded by one of `lock_stripes` process-shared locks
+    (slot index mod stripes). Create the limiter in the parent before
+    forking workers, or pass it to multiprocessing.Process as an argument.
+
+    Two client ids with the same 64-bit fingerprint share a bucket; at
+    2^-64 per pair this is ignored.
+    """
+
+    HEADER = struct.Struct("QQdd")  # slots, lock stripes, capacity, refill_rate
+
+    def __init__(self, capacity: int = 10, refill_rate: float = 1.0,
+                 slots: int = 1 << 16, lock_stripes: int = 64,
+                 name: Optional[str] = None):
+        """
+        Create a new shared bucket table
+
+        Args:
+            capacity: Bucket capacity for every client
+            refill_rate: Tokens added per second for every client
+            slots: Maximum number of distinct clients
+            lock_stripes: Number of process-shared locks guarding the slots
+            name: Shared memory block name (generated if None)
+        """
+        self.slots = slots
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        size = self.HEADER.size + slots * 32
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._owner_pid = os.getpid()
+        self.HEADER.pack_into(self._shm.buf, 0, slots, lock_stripes, float(capacity), float(refill_rate))
+        self._locks = [multiprocessing.Lock() for _ in range(lock_stripes)]
+        self._map_columns()
+
+    def _map_columns(self) -> None:
+        buf = self._shm.buf
+        base = self.HEADER.size
+        column = self.slots * 8
+        self._keys = buf[base:base + column].cast("Q")
+        self._tokens = buf[base + column:base + 2 * column].cast("d")
+        self._last_refill = buf[base + 2 * column:base + 3 * column].cast("d")
+        self._requests = buf[base + 3 * column:base + 4 * column].cast("Q")
+
+    def __getstate__(self):
+        # Child processes re-attach to the block by name; the locks are
+        # transferred by multiprocessing when passed as Process arguments
+        return {"name": self._shm.name, "locks": self._locks}
+
+    def __setstate__(self, state):
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._owner_pid = None
+        self._locks = state["locks"]
+        self.slots, _, capacity, self.refill_rate = self.HEADER.unpack_from(self._shm.buf, 0)
+        self.capacity = int(capacity)
+        self._map_columns()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @staticmethod
+    def _fingerprint(client_id: str) -> int:
+        key = int.from_bytes(hashlib.blake2b(client_id.encode(), digest_size=8).digest(), "little")
+        return key or 1
+
+    def _slot_for(self, key: int, create: bool):
+        """
+        Find (or claim) the slot for a key
+
+        Returns (slot, lock) with the slot's stripe lock held, or None if
+        the key is absent and `create` is False.
+        """
+        slots = self.slots
+        keys = self._keys
+        locks = self._locks
+        stripes = len(locks)
+        slot = key % slots
+        for _ in range(slots):
+            lock = locks[slot % stripes]
+            lock.acquire()
+            stored = keys[slot]
+            if stored == key:
+                return slot, lock
+            if stored == 0:
+                if not create:
+                    lock.release()
+                    return None
+                keys[slot] = key
+                self._tokens[slot] = self.capacity
+                self._last_refill[slot] = time.monotonic()
+                self._requests[slot] = 0
+                return slot, lock
+            lock.release()
+            slot = (slot + 1) % slots
+        if create:
+            raise RuntimeError("Shared bucket table is full")
+        return None
+
+    def _refill(self, slot: int, now: float) -> float:
+        last_refill = self._last_refill[slot]
+        if now <= last_refill:
+            # Another process read the clock later but took the lock first
+            return self._tokens[slot]
+        current = self._tokens[slot] + (now - last_refill) * self.refill_rate
+        if current > self.capacity:
+            current = self.capacity
+        self._last_refill[slot] = now
+        return current
+
+    def is_allowed(self, client_id: str, tokens: int = 1) -> RateLimitResponse:
+        """
+        Check if request is allowed for client, across all processes
+
+        Args:
+            client_id: Unique identifier for the client
+            tokens: Number of tokens to consume
+
+        Returns:
+            RateLimitResponse with result and metadata
+        """
+        slot, lock = self._slot_for(self._fingerprint(client_id), create=True)
+        try:
+            current = self._refill(slot, time.monotonic())
+            total_requests = self._requests[slot] + 1
+            self._requests[slot] = total_requests
+            if current >= tokens:
+                self._tokens[slot] = current - tokens
+                return RateLimitResponse(
+                    result=RateLimitResult.ALLOWED,
+                    tokens_remaining=int(current - tokens),
+                    total_requests=total_requests
+                )
+            self._tokens[slot] = current
+        finally:
+            lock.release()
+        retry_after = (tokens - current) / self.refill_rate if self.refill_rate else float("inf")
+        return RateLimitResponse(
+            result=RateLimitResult.RATE_LIMITED,
+            tokens_remaining=int(current),
+            retry_after_seconds=retry_after,
+            total_requests=total_requests
+        )
+
+    def get_client_stats(self, client_id: str) -> Dict:
+        """Get statistics for a specific client"""
+        found = self._slot_for(self._fingerprint(client_id), create=False)
+        if found is None:
+            return {"error": "Client not found"}
+        slot, lock = found
+        try:
+            current = self._refill(slot, time.monotonic())
+            self._tokens[slot] = current
+            requests = self._requests[slot]
+        finally:
+            lock.release()
+        return {
+            "client_id": client_id,
+            "tokens_available": int(current),
+            "bucket_capacity": self.capacity,
+            "refill_rate": self.refill_rate,
+            "total_requests": requests
+        }
+
+    def reset_client(self, client_id: str) -> bool:
+        """Reset a client's bucket to full capacity"""
+        found = self._slot_for(self._fingerprint(client_id), create=False)
+        if found is None:
+            return False
+        slot, lock = found
+        try:
+            self._tokens[slot] = self.capacity
+            self._last_refill[slot] = time.monotonic()
+        finally:
+            lock.release()
+        return True
+
+    def close(self) -> None:
+        """Detach this process from the shared block (the creator also frees it)"""
+        for view in (self._keys, self._tokens, self._last_refill, self._requests):
+            view.release()
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+
+
+def _hammer(limiter: SharedMemoryRateLimiter, client_ids, ops: int, start, results) -> None:
+    """Worker process: issue `ops` checks round-robin over client_ids"""
+    allowed = 0
+    start.wait()
+    began = time.perf_counter()
+    for i in range(ops):
+        if limiter.is_allowed(client_ids[i % len(client_ids)]).result == RateLimitResult.ALLOWED:
+            allowed += 1
+    results.put((allowed, time.perf_counter() - began))
+    limiter.close()
+
+
+def verify_multiprocess_limit(processes: int = 4, ops_per_process: int = 20_000,
+                              clients: int = 100, capacity: int = 50) -> Dict:
+    """
+    Check that N processes together never exceed one shared limit
+
+    The refill rate is negligible for the length of the run, so exactly
+    `capacity` requests per client may be admitted in total no matter how
+    many processes compete. Also reports aggregate decisions per second.
+    """
+    limiter = SharedMemoryRateLimiter(capacity=capacity, refill_rate=1e-6, slots=4096)
+    client_ids = [f"client_{i}" for i in range(clients)]
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_hammer,
+                                       args=(limiter, client_ids, ops_per_process, start, results))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    total_allowed = sum(allowed for allowed, _ in outcomes)
+    slowest = max(elapsed for _, elapsed in outcomes)
+    counted = sum(limiter.get_client_stats(c)["total_requests"] for c in client_ids)
+    limiter.close()
+    report = {
+        "allowed": total_allowed,
+        "expected": clients * capacity,
+        "requests_counted": counted,
+        "requests_sent": processes * ops_per_process,
+        "ops_per_second": processes * ops_per_process / slowest
+    }
+    assert report["allowed"] == report["expected"], report
+    assert report["requests_counted"] == report["requests_sent"], report
+    return report
+
+
+if __name__ == "__main__":
+    print("=== Shared-Memory Rate Limiter ===\n")
+    for processes in (1, 2, 4):
+        report = verify_multiprocess_limit(processes=processes)
+        print(f"{processes} processes: {report['allowed']}/{report['expected']} admitted "
+              f"(limit held), {report['ops_per_second']:,.0f} decisions/s")
@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional
+
+from rate_limiter import TokenBucket
+
+
+class ShaperQueueFull(RuntimeError):
+    """Raised by TrafficShaper.submit when the queue bound is reached"""
+
+
+@dataclass
+class _Job:
+    """One queued call"""
+    func: Callable
+    args: tuple
+    kwargs: dict
+    tokens: int
+    future: Future
+    enqueued_at: float
+
+
+@dataclass
+class _ClientQueue:
+    """Pending jobs and deficit-round-robin credit for one client"""
+    jobs: Deque[_Job] = field(default_factory=deque)
+    deficit: int = 0
+
+
+class TrafficShaper:
+    """
+    Leaky bucket shaper: delays work instead of rejecting it
+
+    Submitted calls are queued per client and released by a single
+    scheduler thread at the pace of a TokenBucket (refill_rate tokens per
+    second, bursts of at most `capacity`). With capacity=1 this is a
+    strict leaky bucket: one release every 1 / refill_rate seconds.
+
+    Clients are served by deficit round robin: each turn a client gains
+    `quantum` tokens of credit and may release jobs while its credit
+    covers their cost, so a client flooding the queue cannot starve the
+    others and expensive jobs are charged by their token cost.
+
+    Jobs run on the scheduler thread unless an executor is given (use one
+    when jobs block, e.g. outbound HTTP calls, so pacing is not delayed by
+    a slow call). submit() returns a concurrent.futures.Future; asyncio
+    code can await it with asyncio.wrap_future().
+    """
+
+    def __init__(self, refill_rate: float, capacity: int = 1,
+                 max_queue: int = 10_000, max_queue_per_client: Optional[int] = None,
+                 quantum: int = 1, executor: Optional[Executor] = None,
+                 latency_samples: int = 10_000):
+        """
+        Initialize the shaper (call start() to begin releasing)
+
+        Args:
+            refill_rate: Tokens released per second
+            capacity: Largest burst released back to back after an idle period
+            max_queue: Maximum jobs waiting across all clients
+            max_queue_per_client: Maximum jobs waiting for one client (optional)
+            quantum: Tokens of credit a client gains per round-robin turn
+            executor: Runs released jobs; None runs them on the scheduler thread
+            latency_samples: Recent queueing delays kept for percentiles
+        """
+        self.bucket = TokenBucket(capacity, refill_rate, initial_tokens=capacity)
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.quantum = quantum
+        self.executor = executor
+        self.queues: Dict[str, _ClientQueue] = {}
+        self._active: Deque[str] = deque()
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="traffic-shaper", daemon=True)
+
+        self.submitted = 0
+        self.released = 0
+        self.rejected = 0
+        self._started_at: Optional[float] = None
+        self._waits: Deque[float] = deque(maxlen=latency_samples)
+
+    def start(self) -> "TrafficShaper":
+        self._started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def submit(self, client_id: str, func: Callable, *args, tokens: int = 1, **kwargs) -> Future:
+        """
+        Queue a call to be released at the shaped rate
+
+        Args:
+            client_id: Fair-queuing key (e.g. tenant or caller)
+            func: Callable to run when released
+            tokens: Cost of the call in tokens
+
+        Returns:
+            Future resolving to func's result
+
+        Raises:
+            ShaperQueueFull: The global or per-client queue bound is reached
+        """
+        if tokens > self.bucket.capacity:
+            raise ValueError("tokens exceeds the shaper's burst capacity")
+        future: Future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Shaper is stopped")
+            queue = self.queues.get(client_id)
+            if self._queued >= self.max_queue or (
+                    queue is not None and self.max_queue_per_client is not None
+                    and len(queue.jobs) >= self.max_queue_per_client):
+                self.rejected += 1
+                raise ShaperQueueFull(f"Shaper queue is full for {client_id!r}")
+            if queue is None:
+                queue = self.queues[client_id] = _ClientQueue()
+            if not queue.jobs:
+                self._active.append(client_id)
+            queue.jobs.append(_Job(func, args, kwargs, tokens, future, time.monotonic()))
+            self._queued += 1
+            self.submitted += 1
+            self._cond.notify()
+        return future
+
+    def _next_job(self) -> Optional[_Job]:
+        """
+        Block until a job may be released and dequeue it (None once stopped)
+
+        Called with the condition held.
+        """
+        active = self._active
+        while True:
+            if not active:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+                continue
+            client_id = active[0]
+            queue = self.queues[client_id]
+            job = queue.jobs[0]
+            if job.future.cancelled():
+                self._dequeue(client_id, queue)
+                continue
+            if queue.deficit < job.tokens:
+                queue.deficit += self.quantum
+                active.rotate(-1)
+                continue
+            wait = self.bucket.time_until_tokens(job.tokens)
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            self.bucket.consume(job.tokens)
+            queue.deficit -= job.tokens
+            self._dequeue(client_id, queue)
+            return job
+
+    def _dequeue(self, client_id: str, queue: _ClientQueue) -> None:
+        queue.jobs.popleft()
+        self._queued -= 1
+        if not queue.jobs:
+            # An idle client keeps no credit and leaves the rotation
+            self._active.popleft()
+            del self.queues[client_id]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job()
+                if job is None:
+                    return
+                self.released += 1
+                self._waits.append(time.monotonic() - job.enqueued_at)
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if self.executor is not None:
+                self.executor.submit(self._execute, job)
+            else:
+                self._execute(job)
+
+    @staticmethod
+    def _execute(job: _Job) -> None:
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except BaseException as exc:
+            job.future.set_exception(exc)
+        else:
+            job.future.set_result(result)
+
+    def stop(self, drain: bool = True) -> None:
+        """
+        Stop the scheduler
+
+        Args:
+            drain: Release everything already queued first (at the shaped
+                rate); otherwise, or if the shaper was never started,
+                cancel the pending futures
+        """
+        with self._cond:
+            self._stopping = True
+            # Nothing would ever release the queue of a shaper never started
+            if not drain or self._started_at is None:
+                for queue in self.queues.values():
+                    for job in queue.jobs:
+                        job.future.cancel()
+                self.queues.clear()
+                self._active.clear()
+                self._queued = 0
+            self._cond.notify()
+        if self._started_at is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict:
+        """Throughput and queueing-delay statistics"""
+        with self._cond:
+            waits = sorted(self._waits)
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            stats = {
+                "submitted": self.submitted,
+                "released": self.released,
+                "rejected": self.rejected,
+                "queued": self._queued,
+                "active_clients": len(self._active),
+                "throughput_per_second": self.released / elapsed if elapsed else 0.0
+            }
+        for name, fraction in (("p50", 0.50), ("p99", 0.99)):
+            stats[f"queue_delay_{name}_seconds"] = waits[int(fraction * (len(waits) - 1))] if waits else 0.0
+        stats["queue_delay_max_seconds"] = waits[-1] if waits else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    print("=== Leaky Bucket Traffic Shaper ===\n")
+    shaper = TrafficShaper(refill_rate=100.0, max_queue=250, max_queue_per_client=200).start()
+    finished_at: Dict[str, float] = {}
+    began = time.monotonic()
+
+    def call_partner(client_id: str) -> None:
+        finished_at[client_id] = time.monotonic() - began
+
+    futures = []
+    # One bulk job floods the queue; two interactive clients trickle in behind it
+    for _ in range(220):
+        try:
+            futures.append(shaper.submit("bulk_import", call_partner, "bulk_import"))
+        except ShaperQueueFull:
+            pass
+    for i in range(10):
+        futures.append(shaper.submit("checkout", call_partner, "checkout"))
+        futures.append(shaper.submit("search", call_partner, "search"))
+    for future in futures:
+        future.result()
+    shaper.stop()
+
+    for client_id, at in sorted(finished_at.items(), key=lambda pair: pair[1]):
+        print(f"{client_id:>12}: last call released at {at:.2f}s")
+    stats = shaper.stats()
+    print(f"\nReleased {stats['released']} calls at {stats['throughput_per_second']:.0f}/s "
+          f"(configured 100/s), {stats['rejected']} rejected by the queue bound")
+    print(f"Queueing delay p50 {stats['queue_delay_p50_seconds'] * 1000:.0f} ms, "
+          f"p99 {stats['queue_delay_p99_seconds'] * 1000:.0f} ms, "
+          f"max {stats['queue_delay_max_seconds'] * 1000:.0f} ms")
@@ -1,5 +1,17 @@
+import heapq
+import os
+import sys
+import threading
 import time
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Sequence
 from enum import Enum
+from itertools import islice
+from threading import get_ident
+
+from id_allocator import BlockIDAllocator, FileIDCounter
+from url_store import AppendOnlyURLStore, LinkRecord, MemoryURLStore
 
 
 class Expiry(Enum):
@@ -23,12 +35,425 @@ class Base62:
             base62.append(Base62.ALPHABET[rem])
         return ''.join(reversed(base62))
 
+    @staticmethod
+    def decode(code):
+        num = 0
+        for char in code:
+            num = num * 62 + Base62.ALPHABET.index(char)
+        return num
+
+
+class HotLinkCache:
+    """LRU cache of LinkRecords for the most requested short codes"""
+
+    def __init__(self, capacity=10_000):
+        self.capacity = capacity
+        self.records = OrderedDict()  # short_code -> LinkRecord, least recent first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code):
+        record = self.records.get(code)
+        if record is None:
+            self.misses += 1
+            return None
+        try:
+            self.records.move_to_end(code)
+        except KeyError:
+            pass  # evicted by another thread meanwhile
+        self.hits += 1
+        return record
+
+    def put(self, code, record):
+        """Cache a record; returns the evicted (code, record) if the cache was full"""
+        self.records[code] = record
+        if len(self.records) > self.capacity:
+            return self.records.popitem(last=False)
+        return None
+
+    def pop(self, code):
+        return self.records.pop(code, None)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class DigestIndex:
+    """
+    Compact reverse index: long URL -> short code ID
+
+    Entries are keyed by a 64-bit digest of the URL rather than the URL
+    itself and kept in two array('Q') columns with linear probing, so
+    each slot costs 16 bytes instead of a dict entry plus the URL string
+    and two int objects. The digest is Python's string hash (SipHash,
+    keyed per process and cached on the str), which is enough for an
+    index that only lives in memory. Distinct URLs can share a digest, so
+    a hit must be checked against the stored link.
+    """
+
+    MASK = (1 << 64) - 1
+
+    def __init__(self, slots=1 << 16, max_load=0.6):
+        self.max_load = max_load
+        self.count = 0
+        self._allocate(slots)
+
+    def _allocate(self, slots):
+        self._digests = array('Q', bytes(8 * slots))  # 0 marks an empty slot
+        self._ids = array('Q', bytes(8 * slots))
+        self._mask = slots - 1
+        self._limit = int(slots * self.max_load)
+
+    def _slot(self, digest):
+        digests, mask = self._digests, self._mask
+        slot = digest & mask
+        while True:
+            current = digests[slot]
+            if current == digest or not current:
+                return slot
+            slot = (slot + 1) & mask
+
+    def put(self, long_url, code_id):
+        digest = hash(long_url) & self.MASK or 1
+        slot = self._slot(digest)
+        if not self._digests[slot]:
+            slot = self._claim(slot, digest)
+        self._ids[slot] = code_id
+
+    def setdefault(self, long_url, code_id):
+        """The URL's ID if indexed; otherwise index it under code_id and return None"""
+        digest = hash(long_url) & self.MASK or 1
+        # _slot inlined: this runs once per URL of a bulk import
+        digests, mask = self._digests, self._mask
+        slot = digest & mask
+        while True:
+            current = digests[slot]
+            if current == digest:
+                return self._ids[slot]
+            if not current:
+                break
+            slot = (slot + 1) & mask
+        slot = self._claim(slot, digest)
+        self._ids[slot] = code_id
+        return None
+
+    def _claim(self, slot, digest):
+        if self.count >= self._limit:
+            self._grow()
+            slot = self._slot(digest)
+        self.count += 1
+        self._digests[slot] = digest
+        return slot
+
+    def _grow(self):
+        digests, ids = self._digests, self._ids
+        self._allocate(2 * len(digests))
+        for digest, code_id in zip(digests, ids):
+            if digest:
+                slot = self._slot(digest)
+                self._digests[slot] = digest
+                self._ids[slot] = code_id
+
+    def __len__(self):
+        return self.count
+
+    def memory_bytes(self):
+        return self._digests.itemsize * len(self._digests) + self._ids.itemsize * len(self._ids)
+
+
+class ShortURLList(Sequence):
+    """
+    The short URLs of a bulk import, in input order
+
+    Every one is the Base62 code of an ID, so only the IDs are kept, 8
+    bytes per URL in an array, and each URL is built when it is read.
+    """
+
+    def __init__(self, ids, base_url):
+        self.ids = ids
+        self.base_url = base_url
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.base_url + Base62.encode(code_id) for code_id in self.ids[i]]
+        return self.base_url + Base62.encode(self.ids[i])
+
+    def __iter__(self):
+        base_url = self.base_url
+        encode = Base62.encode
+        return (base_url + encode(code_id) for code_id in self.ids)
+
+
+class _Tally:
+    """One thread's redirect counts, and how much of them has been flushed"""
+
+    __slots__ = ("counts", "applied")
 
-class URLShortener:
     def __init__(self):
-        self.count_id = int(time.time())  # Unique counter
-        self.short_url_map = {}  # short_code -> (long_url, expiry_time, access_count)
+        self.counts = {}  # short_code -> redirects; written only by the owning thread
+        self.applied = {}  # the counts as of the last flush; read and written under the flush lock
+
+
+class RedirectCounters:
+    """
+    Per-thread, buffered redirect counters
+
+    Each thread counts its redirects in its own dict, found by thread id,
+    so a redirect is one dict increment with no lock and no contention.
+    flush() copies every thread's dict (dict.copy is a single C call, so
+    the copy is consistent with the owner's writes), hands the growth
+    since the previous flush to `apply(deltas)` and remembers what it
+    applied. Nothing is ever taken out of a dict another thread writes
+    to, so no increment is lost. A thread whose dict reaches `max_codes`
+    distinct codes flushes its own counts and starts a new one; flush()
+    also runs optionally every `flush_interval` seconds from a background
+    thread. count() adds up one code's unflushed redirects without
+    flushing anything. A new thread that is given a finished thread's id
+    carries on with its dict, which still has a single writer.
+    """
+
+    def __init__(self, apply, max_codes=16_384, flush_interval=None):
+        self.apply = apply
+        self.max_codes = max_codes
+        self._counts = {}  # thread id -> the counts dict of that thread's tally
+        self._tallies = {}  # thread id -> _Tally
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval is not None:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                             name="redirect-counter-flush", daemon=True)
+            self._flusher.start()
+
+    def increment(self, code):
+        try:
+            counts = self._counts[get_ident()]
+        except KeyError:
+            counts = self._register()
+        count = counts.get(code)
+        if count is not None:
+            counts[code] = count + 1
+        else:
+            counts[code] = 1
+            if len(counts) >= self.max_codes:
+                self._flush_own()
+
+    def _register(self):
+        thread_id = get_ident()
+        with self._flush_lock:
+            tally = self._tallies[thread_id] = _Tally()
+            self._counts[thread_id] = tally.counts
+        return tally.counts
+
+    def _flush_own(self):
+        """Flush the calling thread's counts and give it an empty dict"""
+        thread_id = get_ident()
+        with self._flush_lock:
+            tally = self._tallies[thread_id]
+            deltas = self._deltas((tally,))
+            tally.counts = self._counts[thread_id] = {}
+            tally.applied = {}
+            if deltas:
+                self.apply(deltas)
+
+    def flush(self):
+        """Move every buffered count into the main store"""
+        with self._flush_lock:
+            deltas = self._deltas(self._tallies.values())
+            if deltas:
+                self.apply(deltas)
+
+    @staticmethod
+    def _deltas(tallies):
+        """Counts added since the previous flush, summed over `tallies`"""
+        deltas = {}
+        for tally in tallies:
+            counts = tally.counts.copy()
+            applied = tally.applied
+            for code, count in counts.items():
+                delta = count - applied.get(code, 0)
+                if delta:
+                    deltas[code] = deltas.get(code, 0) + delta
+            tally.applied = counts
+        return deltas
+
+    def count(self, code, applied):
+        """
+        applied(code), the count flushed so far (None for an unknown code),
+        plus the redirects of `code` not yet flushed
+        """
+        with self._flush_lock:
+            total = applied(code)
+            if total is None:
+                return None
+            for tally in self._tallies.values():
+                total += tally.counts.get(code, 0) - tally.applied.get(code, 0)
+            return total
+
+    def _flush_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+
+class ExpirySweeper:
+    """
+    Actively deletes expired links, so links nobody visits again do not
+    stay in the store forever
+
+    Expiring links are kept in a min-heap of (expiry_time, code). A
+    background thread wakes every `interval` seconds and removes due links
+    in batches of at most `batch_size`, pausing `batch_pause` seconds
+    between full batches so a large backlog (say, a day's worth of links
+    expiring together) is worked off without holding up redirects for
+    long. A heap entry can be stale (the link was deleted or re-created
+    since), so every entry is checked against the store before deleting.
+
+    A hierarchical timing wheel would make scheduling O(1), but a heap
+    push is already cheap next to a store write and keeps exact ordering.
+    """
+
+    def __init__(self, expire, clock=time.time, interval=1.0, batch_size=500, batch_pause=0.001,
+                 latency_samples=10_000):
+        """
+        expire: expire(code, expiry_time, now) deletes the link if it is
+        still due and returns the approximate bytes freed (None if not)
+        clock: wall-clock time source, the one expiry times are based on
+        """
+        self.expire = expire
+        self.clock = clock
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._heap = []  # (expiry_time, code)
+        self._heap_lock = threading.Lock()
+        self.reclaimed_links = 0
+        self.reclaimed_bytes = 0
+        self.batches = 0
+        self._batch_seconds = deque(maxlen=latency_samples)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def schedule(self, code, expiry_time):
+        with self._heap_lock:
+            heapq.heappush(self._heap, (expiry_time, code))
+
+    def schedule_many(self, entries):
+        """Add (code, expiry_time) pairs in bulk, e.g. from a reopened store"""
+        entries = [(expiry_time, code) for code, expiry_time in entries]
+        with self._heap_lock:
+            if len(entries) > len(self._heap):
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+
+    def sweep_batch(self):
+        """Delete at most batch_size due links; returns how many entries were due"""
+        began = time.perf_counter()
+        now = self.clock()
+        with self._heap_lock:
+            heap = self._heap
+            due = []
+            while heap and heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(heap))
+        for expiry_time, code in due:
+            freed = self.expire(code, expiry_time, now)
+            if freed is not None:
+                self.reclaimed_links += 1
+                self.reclaimed_bytes += freed
+        if due:
+            self.batches += 1
+            self._batch_seconds.append(time.perf_counter() - began)
+        return len(due)
+
+    def sweep(self):
+        """Work off every due link now, batch by batch"""
+        while self.sweep_batch() == self.batch_size:
+            pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="url-expiry-sweeper", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        wait = self.interval
+        while not self._stop.wait(wait):
+            # A full batch means more may be due: come back after a short pause
+            wait = self.batch_pause if self.sweep_batch() == self.batch_size else self.interval
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def stats(self):
+        """Reclaimed links and memory, and how long each batch held the sweeper"""
+        seconds = sorted(self._batch_seconds)
+        stats = {
+            "scheduled": len(self._heap),
+            "reclaimed_links": self.reclaimed_links,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "batches": self.batches
+        }
+        for name, fraction in (("p50", 0.50), ("p99", 0.99)):
+            stats[f"batch_{name}_seconds"] = seconds[int(fraction * (len(seconds) - 1))] if seconds else 0.0
+        stats["batch_max_seconds"] = seconds[-1] if seconds else 0.0
+        return stats
+
+
+class URLShortener:
+    def __init__(self, store=None, cache_size=10_000, counter_flush_interval=None,
+                 sweep_interval=None, clock=time.time, id_allocator=None):
+        """
+        store: where links live; MemoryURLStore (the default) or a durable
+        AppendOnlyURLStore so links survive restarts
+        cache_size: hot links kept as LinkRecords in front of a durable store
+        counter_flush_interval: seconds between background flushes of the
+        buffered redirect counts (they are always flushed on read)
+        sweep_interval: seconds between background expiry sweeps; None
+        leaves expired links to be deleted on access or by sweeper.sweep()
+        clock: wall-clock time source for expiry times
+        id_allocator: source of short code IDs (BlockIDAllocator or
+        SnowflakeIDAllocator); by default blocks are leased from a counter
+        file next to a durable store's log, or from memory
+        """
+        self.clock = clock
+        self.short_url_map = store if store is not None else MemoryURLStore()  # short_code -> LinkRecord
+        if id_allocator is None:
+            counter = None if self.short_url_map.in_memory else FileIDCounter(f"{self.short_url_map.path}.ids")
+            id_allocator = BlockIDAllocator(counter)
+        self.ids = id_allocator
+        self._long_urls = None  # DigestIndex, built on first shorten_many
+        self._index_lock = threading.Lock()
+        # An in-memory store already holds every link as a record; a cache
+        # in front of it would only add work
+        self.cache = None if self.short_url_map.in_memory else HotLinkCache(cache_size)
+        self._records = self.short_url_map.links if self.cache is None else self.cache.records
+        self._lookup = self._records.get if self.cache is None else self.cache.get
+        self.access_counts = {}  # short_code -> access_count, for links evicted from the cache
+        self.counters = RedirectCounters(self._apply_counts, flush_interval=counter_flush_interval)
+        self._count_redirect = self.counters.increment
+        self._lock = threading.Lock()  # guards moving counts between records and access_counts
         self.base_url = "https://short.ly/"
+        self.sweeper = ExpirySweeper(self._expire, clock=clock, interval=sweep_interval or 1.0)
+        self.sweeper.schedule_many(self.short_url_map.expiries())
+        if sweep_interval is not None:
+            self.sweeper.start()
 
     def shorten_url(self, long_url, alias=None, expiry=Expiry.NEVER):
         """Shorten a URL with an optional custom alias and expiry time."""
@@ -37,40 +462,395 @@ class URLShortener:
                 raise ValueError("Alias already exists")
             short_code = alias
         else:
-            self.count_id += 1
-            short_code = Base62.encode(self.count_id)
+            code_id = self.ids.next_id()
+            short_code = Base62.encode(code_id)
+            # Skip codes a custom alias has already taken
+            while short_code in self.short_url_map:
+                code_id = self.ids.next_id()
+                short_code = Base62.encode(code_id)
 
-        expiry_time = int(time.time()) + expiry.value if expiry.value else None
-        self.short_url_map[short_code] = (long_url, expiry_time, 0)
+        expiry_time = int(self.clock()) + expiry.value if expiry.value else None
+        if not alias and expiry_time is None and self._long_urls is not None:
+            # Stored and indexed together, so shorten_many never sees one without the other
+            with self._index_lock:
+                self.short_url_map.put(short_code, long_url, expiry_time)
+                self._long_urls.put(long_url, code_id)
+        else:
+            self.short_url_map.put(short_code, long_url, expiry_time)
+        if expiry_time:
+            self.sweeper.schedule(short_code, expiry_time)
         return self.base_url + short_code
 
+    def _long_url_index(self):
+        """The long URL -> ID index, built from the store on first use"""
+        with self._index_lock:
+            if self._long_urls is None:
+                index = DigestIndex()
+                store = self.short_url_map
+                alphabet = set(Base62.ALPHABET)
+                for code in store.codes():
+                    # Aliases count too when they are valid Base62 codes
+                    if not alphabet.issuperset(code):
+                        continue
+                    code_id = Base62.decode(code)
+                    if Base62.encode(code_id) != code:
+                        continue
+                    record = store.get(code)
+                    if record is not None and record.expiry_time is None:
+                        index.put(record.long_url, code_id)
+                self._long_urls = index
+            return self._long_urls
+
+    def _id_stream(self):
+        """IDs for a bulk import, continuing the allocator's current block when it has one"""
+        id_stream = getattr(self.ids, "id_stream", None)
+        if id_stream is None:
+            return iter(self.ids.next_id, None)
+        return id_stream()
+
+    def shorten_many(self, long_urls, expiry=Expiry.NEVER, batch_size=10_000):
+        """
+        Shorten a stream of URLs; returns their short URLs in input order
+        as a ShortURLList, once every link is stored
+
+        Input is read `batch_size` URLs at a time and each batch's new
+        links are written to the store together (one write and one fsync
+        for a durable store). IDs continue the allocator's current block,
+        and what a call leaves unused is issued to later calls.
+
+        Never-expiring URLs that already have a never-expiring link, from
+        earlier calls or earlier in the same stream, get that link's code
+        back instead of a new one. Links with an expiry are not shared.
+        A batch is checked, indexed and stored under the index lock, so a
+        concurrent shorten_url or shorten_many either sees its links or
+        adds its own first.
+        """
+        expiry_time = int(self.clock()) + expiry.value if expiry.value else None
+        index = self._long_url_index() if expiry_time is None else None
+        store = self.short_url_map
+        next_id = self._id_stream().__next__
+        encode = Base62.encode
+        long_urls = iter(long_urls)
+        ids = array("Q")
+        code_id = None  # drawn but not yet used, kept when a URL turns out to be a duplicate
+
+        for chunk in iter(lambda: list(islice(long_urls, batch_size)), []):
+            pending = {}  # code -> long_url, written once the chunk is done
+            with self._index_lock:
+                for long_url in chunk:
+                    if code_id is None:
+                        code_id = next_id()
+                    if index is not None:
+                        known = index.setdefault(long_url, code_id)
+                        if known is not None:
+                            known_code = encode(known)
+                            stored = pending.get(known_code)
+                            if stored is None:
+                                record = store.get(known_code)
+                                if record is not None and record.expiry_time is None:
+                                    stored = record.long_url
+                            if stored == long_url:
+                                ids.append(known)
+                                continue
+                            # A digest collision or a deleted link: index the new code instead
+                            index.put(long_url, code_id)
+                    code = encode(code_id)
+                    if code in store:
+                        # Taken by a custom alias
+                        code_id, code = self._unused_id(next_id)
+                        if index is not None:
+                            index.put(long_url, code_id)
+                    pending[code] = long_url
+                    ids.append(code_id)
+                    code_id = None
+                self._store_batch(pending, expiry_time)
+        return ShortURLList(ids, self.base_url)
+
+    def _unused_id(self, next_id):
+        """Next ID whose code no custom alias has taken, with its code"""
+        code_id = next_id()
+        code = Base62.encode(code_id)
+        while code in self.short_url_map:
+            code_id = next_id()
+            code = Base62.encode(code_id)
+        return code_id, code
+
+    def _store_batch(self, pending, expiry_time):
+        if not pending:
+            return
+        self.short_url_map.put_many(list(pending.items()), expiry_time)
+        if expiry_time:
+            self.sweeper.schedule_many((code, expiry_time) for code in pending)
+
+    def _code(self, short_url):
+        """Short code from a short URL (or a bare code) by prefix slicing"""
+        base_url = self.base_url
+        if short_url.startswith(base_url):
+            return short_url[len(base_url):]
+        return short_url
+
+    def _load_record(self, key):
+        """Cache miss: fetch the link's record from the durable store"""
+        if self.cache is None:
+            return None
+        record = self.short_url_map.get(key)
+        if record is None:
+            return None
+        with self._lock:
+            cached = self.cache.records.get(key)
+            if cached is not None:
+                # Another thread missed on the same code and loaded it first
+                return cached
+            record.access_count = self.access_counts.pop(key, 0)
+            evicted = self.cache.put(key, record)
+            if evicted is not None:
+                self.access_counts[evicted[0]] = evicted[1].access_count
+        return record
+
+    def _expire(self, key, expiry_time=None, now=None):
+        """
+        Delete an expired link with its cached record and count
+
+        With expiry_time (from the sweeper) the link is only deleted if it
+        still carries that expiry and it has passed, since it may have been
+        deleted or re-created since it was scheduled.
+
+        Returns:
+            Approximate bytes of memory freed, or None if nothing was deleted
+        """
+        record = self._records.get(key)
+        if record is None:
+            record = self.short_url_map.get(key)
+            if record is None:
+                return None
+        if expiry_time is not None and (record.expiry_time != expiry_time or expiry_time > now):
+            return None
+        if not self.short_url_map.delete(key):
+            return None
+        self._records.pop(key, None)
+        with self._lock:
+            self.access_counts.pop(key, None)
+        # Durable stores keep only the code and an offset in memory
+        if self.short_url_map.in_memory:
+            return sys.getsizeof(key) + sys.getsizeof(record) + sys.getsizeof(record.long_url)
+        return sys.getsizeof(key) + sys.getsizeof(0)
+
+    def _apply_counts(self, deltas):
+        """Add flushed redirect counts to the links' records"""
+        with self._lock:
+            for key, delta in deltas.items():
+                record = self._records.get(key)
+                if record is not None:
+                    record.access_count += delta
+                elif key in self.short_url_map:
+                    self.access_counts[key] = self.access_counts.get(key, 0) + delta
+
     def get_long_url(self, short_url):
         """Retrieve the original URL and update access count."""
-        key = short_url.replace(self.base_url, "")
-
-        if key not in self.short_url_map:
-            return "Error: Short URL not found."
+        # Prefix slicing, inlined: this is the hottest path
+        base_url = self.base_url
+        key = short_url[len(base_url):] if short_url.startswith(base_url) else short_url
 
-        long_url, expiry_time, count = self.short_url_map[key]
+        record = self._lookup(key)
+        if record is None:
+            record = self._load_record(key)
+            if record is None:
+                return "Error: Short URL not found."
 
-        if expiry_time and expiry_time < int(time.time()):
-            del self.short_url_map[key]
+        if record.expiry_time and record.expiry_time < self.clock():
+            self._expire(key)
             raise ValueError("Error: This URL has expired.")
 
         # Update access count
-        self.short_url_map[key] = (long_url, expiry_time, count + 1)
-        return long_url
+        self._count_redirect(key)
+        return record.long_url
 
     def get_url_redirect_count(self, short_url):
         """Return the number of times a short URL has been accessed."""
-        key = short_url.replace(self.base_url, "")
-        if key in self.short_url_map:
-            return self.short_url_map[key][2]
-        return "Error: Short URL not found."
+        count = self.counters.count(self._code(short_url), self._applied_count)
+        return "Error: Short URL not found." if count is None else count
+
+    def _applied_count(self, key):
+        """Redirects already flushed into the link's record, None for an unknown link"""
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                return record.access_count
+            if key in self.short_url_map:
+                return self.access_counts.get(key, 0)
+        return None
+
+    def close(self):
+        """Stop background threads, flush redirect counts and close the store"""
+        self.sweeper.stop()
+        self.counters.close()
+        self.short_url_map.close()
+        self.ids.close()
+
+
+def benchmark_counters(threads=32, redirects_per_thread=20_000, links=100):
+    """
+    Count redirects from many threads three ways and check the totals
+
+    - unlocked: record.access_count += 1, as get_long_url used to
+    - global_lock: the same under one shared lock
+    - buffered: RedirectCounters, per-thread dicts flushed once at the end
+
+    Returns:
+        {mode: {"increments_per_second": ..., "lost_increments": ...}}
+    """
+    results = {}
+    for mode in ("unlocked", "global_lock", "buffered"):
+        records = {f"c{i}": LinkRecord(f"https://example.com/{i}", None) for i in range(links)}
+        codes = list(records)
+        lock = threading.Lock()
+
+        def apply(deltas):
+            for code, delta in deltas.items():
+                records[code].access_count += delta
+
+        counters = RedirectCounters(apply)
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(offset):
+            barrier.wait()
+            for i in range(redirects_per_thread):
+                code = codes[(offset + i) % links]
+                if mode == "unlocked":
+                    records[code].access_count += 1
+                elif mode == "global_lock":
+                    with lock:
+                        records[code].access_count += 1
+                else:
+                    counters.increment(code)
+
+        workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        began = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        counters.flush()
+        elapsed = time.perf_counter() - began
+        counted = sum(record.access_count for record in records.values())
+        results[mode] = {
+            "increments_per_second": threads * redirects_per_thread / elapsed,
+            "lost_increments": threads * redirects_per_thread - counted
+        }
+    return results
+
+
+def benchmark_redirects(store=None, links=100_000, redirects=1_000_000, cache_size=10_000):
+    """
+    Redirects/sec for a Zipf-like mix of short URLs, plus the cache hit
+    ratio when the store is durable (None for the in-memory store)
+    """
+    import random
+    rng = random.Random(5)
+    shortener = URLShortener(store=store, cache_size=cache_size)
+    try:
+        short_urls = [shortener.shorten_url(f"https://example.com/page/{i}") for i in range(links)]
+        # Popularity falls off as 1/rank
+        traffic = [short_urls[min(links - 1, int(links ** rng.random()) - 1)] for _ in range(redirects)]
+        get_long_url = shortener.get_long_url
+        began = time.perf_counter()
+        for short_url in traffic:
+            get_long_url(short_url)
+        elapsed = time.perf_counter() - began
+        return {
+            "redirects_per_second": redirects / elapsed,
+            "cache_hit_ratio": shortener.cache.hit_ratio() if shortener.cache is not None else None
+        }
+    finally:
+        shortener.close()
+
+
+def benchmark_expiry_sweeper(links=200_000, expiring=0.5, redirects=300_000, batch_size=500):
+    """
+    Expire a share of the links all at once and measure what sweeping costs
+
+    Redirects to the links that stay live are timed with no sweep running
+    and again while the background sweeper deletes the expired ones.
+
+    Returns:
+        Redirects/s without and during the sweep, the time to reclaim
+        everything and the sweeper's stats
+    """
+    now = [time.time()]
+    shortener = URLShortener(clock=lambda: now[0])
+    shortener.sweeper.batch_size = batch_size
+    cut = int(links * expiring)
+    live = []
+    for i in range(links):
+        short_url = shortener.shorten_url(f"https://example.com/campaign/{i}",
+                                          expiry=Expiry.ONE_HOUR if i < cut else Expiry.NEVER)
+        if i >= cut:
+            live.append(short_url)
+    traffic = [live[i % len(live)] for i in range(redirects)]
+    get_long_url = shortener.get_long_url
+
+    def redirects_per_second():
+        began = time.perf_counter()
+        for short_url in traffic:
+            get_long_url(short_url)
+        return redirects / (time.perf_counter() - began)
+
+    idle = redirects_per_second()
+    now[0] += Expiry.ONE_DAY.value
+    shortener.sweeper.interval = 0.01
+    began = time.perf_counter()
+    shortener.sweeper.start()
+    during = redirects_per_second()
+    while len(shortener.sweeper):
+        time.sleep(0.001)
+    sweep_seconds = time.perf_counter() - began
+    remaining = len(shortener.short_url_map)
+    shortener.close()
+    return {
+        "redirects_per_second_idle": idle,
+        "redirects_per_second_during_sweep": during,
+        "sweep_seconds": sweep_seconds,
+        "links_remaining": remaining,
+        **shortener.sweeper.stats()
+    }
+
+
+def benchmark_shorten_many(path, lines=10_000_000, store=None, batch_size=10_000):
+    """
+    URLs/sec for shorten_many over a file of `lines` URLs, one per line
+
+    About one line in five repeats an earlier URL, as in a campaign import
+    that lists the same landing page many times. The file is written
+    first (not timed) and removed afterwards.
+    """
+    with open(path, "w") as f:
+        f.writelines(f"https://example.com/landing/{i if i % 5 else i // 5}?utm_campaign=spring\n"
+                     for i in range(lines))
+
+    shortener = URLShortener(store=store)
+    began = time.perf_counter()
+    with open(path) as f:
+        shortened = len(shortener.shorten_many((line.rstrip("\n") for line in f), batch_size=batch_size))
+    elapsed = time.perf_counter() - began
+    links = len(shortener.short_url_map)
+    index = shortener._long_urls
+    report = {
+        "urls_per_second": shortened / elapsed,
+        "seconds": elapsed,
+        "links_created": links,
+        "duplicates_reused": shortened - links,
+        "reverse_index_bytes_per_url": index.memory_bytes() / len(index)
+    }
+    shortener.close()
+    os.remove(path)
+    return report
 
 
 # Example Usage
 if __name__ == "__main__":
+    # The benchmarks below run at demo size; --benchmark runs them at full size (several minutes)
+    full = "--benchmark" in sys.argv[1:]
     shortener = URLShortener()
     
     # Generate a short URL
@@ -84,3 +864,59 @@ if __name__ == "__main__":
     print("Original URL:", shortener.get_long_url(short_url))
     # Check the redirect count
     print("Redirect Count:", shortener.get_url_redirect_count(short_url))
+
+    report = benchmark_expiry_sweeper() if full else benchmark_expiry_sweeper(links=10_000, redirects=20_000)
+    print(f"Expiry sweep: {report['reclaimed_links']:,} expired links reclaimed in {report['sweep_seconds']:.2f} s, "
+          f"~{report['reclaimed_bytes'] / 2**20:.1f} MiB freed, {report['links_remaining']:,} live links kept")
+    print(f"Expiry sweep: batch p50 {report['batch_p50_seconds'] * 1000:.2f} ms / "
+          f"p99 {report['batch_p99_seconds'] * 1000:.2f} ms / max {report['batch_max_seconds'] * 1000:.2f} ms; "
+          f"redirects {report['redirects_per_second_idle']:,.0f}/s idle, "
+          f"{report['redirects_per_second_during_sweep']:,.0f}/s during the sweep")
+
+    import tempfile
+
+    for mode, figures in (benchmark_counters() if full else benchmark_counters(8, 5_000)).items():
+        print(f"Redirect counting, {32 if full else 8} threads, {mode}: {figures['increments_per_second']:,.0f} increments/s, "
+              f"{figures['lost_increments']:,} lost")
+
+    # Bulk import with deduplication
+    imported = list(shortener.shorten_many(["https://example.com/a", "https://example.com/b",
+                                            "https://example.com/a", "https://example.com"]))
+    print("Bulk import:", imported)
+    import_dir = tempfile.mkdtemp()
+    import_log = os.path.join(import_dir, "links.log")
+    lines = 1_000_000 if full else 20_000
+    for name, store in (("memory store", None), ("append-only store", AppendOnlyURLStore(import_log))):
+        report = benchmark_shorten_many(os.path.join(import_dir, "import.txt"), lines=lines, store=store)
+        print(f"shorten_many ({name}): {report['urls_per_second']:,.0f} URLs/s over {lines:,} lines, "
+              f"{report['links_created']:,} links created, {report['duplicates_reused']:,} duplicates reused, "
+              f"reverse index {report['reverse_index_bytes_per_url']:.0f} bytes/URL")
+    os.remove(import_log)
+    os.remove(f"{import_log}.ids")
+
+    # Durable storage: links survive a restart
+    from url_store import benchmark_store
+
+    sizes = {} if full else {"links": 10_000, "redirects": 100_000}
+    report = benchmark_redirects(**sizes)
+    print(f"Redirect path (memory store): {report['redirects_per_second']:,.0f} redirects/s")
+    log_path = os.path.join(tempfile.mkdtemp(), "links.log")
+    report = benchmark_redirects(AppendOnlyURLStore(log_path, sync=False), **sizes)
+    print(f"Redirect path (append-only store): {report['redirects_per_second']:,.0f} redirects/s, "
+          f"hot-link cache hit ratio {report['cache_hit_ratio']:.1%}")
+    os.remove(log_path)
+    os.remove(f"{log_path}.ids")
+
+    durable = URLShortener(store=AppendOnlyURLStore(log_path))
+    short_url = durable.shorten_url("https://example.com/durable")
+    durable.close()
+    reopened = URLShortener(store=AppendOnlyURLStore(log_path))
+    print("After restart:", reopened.get_long_url(short_url))
+    reopened.close()
+    os.remove(f"{log_path}.ids")
+
+    report = benchmark_store(log_path) if full else benchmark_store(log_path, links=10_000)
+    print(f"Append-only store: {report['writes_per_second']:,.0f} durable writes/s "
+          f"({report['fsyncs_per_write']:.2f} fsyncs/write with group commit), "
+          f"index rebuilt in {report['reopen_seconds'] * 1000:.0f} ms, "
+          f"{report['reads_per_second']:,.0f} reads/s")
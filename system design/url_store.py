@@ -0,0 +1,461 @@
+"""
+Storage engines for URLShortener
+
+MemoryURLStore keeps links as LinkRecords in a dict and loses them on
+restart. AppendOnlyURLStore persists them in an append-only log:
+
+    record  u32 crc32 | u8 kind | u16 code length | u32 url length | i64 expiry |
+            code UTF-8 | long url UTF-8
+
+kind is PUT or DELETE (a tombstone; url length 0); expiry is a Unix
+timestamp, 0 for never. The CRC covers everything after itself, so a
+record torn by a crash is detected on startup and cut off.
+
+Only the index (short code -> record offset) lives in memory. Reads go
+through an mmap of the log, remapped when it has grown past the mapped
+length; readers take the index and its map as one pair, so a compaction
+swapping in a new file never pairs an old offset with the new map.
+
+Writes go to the OS straight away but fsync is group-committed: the
+first writer to need durability syncs everything written so far and
+concurrent writers waiting on the same fsync are released together. The
+file is only closed or swapped while no fsync is running.
+compact() rewrites the log with only live, unexpired records.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+RECORD = struct.Struct("<IBHIq")  # crc, kind, code length, url length, expiry
+PUT = 1
+DELETE = 2
+
+
+class LinkRecord:
+    """Mutable per-link state, so a redirect updates it in place"""
+    __slots__ = ("long_url", "expiry_time", "access_count")
+
+    def __init__(self, long_url: str, expiry_time: Optional[int], access_count: int = 0):
+        self.long_url = long_url
+        self.expiry_time = expiry_time
+        self.access_count = access_count
+
+
+class MemoryURLStore:
+    """
+    Links in a plain dict; the default store, nothing survives a restart
+
+    get() hands out the stored record itself, so callers may update its
+    access count in place.
+    """
+
+    in_memory = True
+
+    def __init__(self):
+        self.links: Dict[str, LinkRecord] = {}
+
+    def put(self, code: str, long_url: str, expiry_time: Optional[int] = None) -> None:
+        self.links[code] = LinkRecord(long_url, expiry_time)
+
+    def put_many(self, links: List[Tuple[str, str]], expiry_time: Optional[int] = None) -> None:
+        """Store (code, long_url) pairs sharing one expiry"""
+        self.links.update((code, LinkRecord(long_url, expiry_time)) for code, long_url in links)
+
+    def get(self, code: str) -> Optional[LinkRecord]:
+        return self.links.get(code)
+
+    def delete(self, code: str) -> bool:
+        return self.links.pop(code, None) is not None
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.links
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+    def codes(self) -> Iterator[str]:
+        return iter(list(self.links))
+
+    def expiries(self) -> Iterator[Tuple[str, int]]:
+        """(code, expiry_time) of every link that expires"""
+        return ((code, record.expiry_time) for code, record in list(self.links.items()) if record.expiry_time)
+
+    def close(self) -> None:
+        pass
+
+
+class AppendOnlyURLStore:
+    """
+    Links persisted in an append-only log with an in-memory offset index
+
+    Thread-safe: appends, index updates and compaction are serialized by
+    one lock; reads only take it to remap the file. A read that started
+    before a compaction finishes on the old file's map. get() decodes a fresh
+    LinkRecord (access count 0) on every call, so put a cache in front.
+    """
+
+    in_memory = False
+
+    def __init__(self, path: str, sync: bool = True,
+                 compact_interval: Optional[float] = None, compact_garbage_ratio: float = 0.5):
+        """
+        Open (or create) a log and rebuild its index
+
+        Args:
+            path: Log file path
+            sync: fsync (group-committed) before put/delete return
+            compact_interval: Seconds between background compaction checks (optional)
+            compact_garbage_ratio: Compact when at least this share of the log is dead
+        """
+        self.path = path
+        self.sync = sync
+        self.compact_garbage_ratio = compact_garbage_ratio
+        self.index: Dict[str, int] = {}
+        self.live_bytes = 0
+        self._lock = threading.RLock()
+        self._synced = threading.Condition(threading.Lock())
+        self._syncing = False
+        self._written_seq = 0
+        self._synced_seq = 0
+        self.fsyncs = 0
+        self._file = open(path, "a+b")
+        # (index, map of the file its offsets point into), replaced as one object
+        self._mapped: Tuple[Dict[str, int], Optional[mmap.mmap]] = (self.index, None)
+        self.load_seconds = self._load()
+
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval is not None:
+            self._compactor = threading.Thread(target=self._compact_periodically, args=(compact_interval,),
+                                               name="url-store-compactor", daemon=True)
+            self._compactor.start()
+
+    # Startup
+
+    def _load(self) -> float:
+        """Scan the log once to rebuild the index; returns the seconds taken"""
+        began = time.perf_counter()
+        size = os.fstat(self._file.fileno()).st_size
+        mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        index = self.index
+        unpack = RECORD.unpack_from
+        header = RECORD.size
+        crc32 = zlib.crc32
+        offset = 0
+        lengths: Dict[str, int] = {}
+        while offset + header <= size:
+            crc, kind, code_len, url_len, _ = unpack(mm, offset)
+            end = offset + header + code_len + url_len
+            if end > size or crc32(mm[offset + 4:end]) != crc:
+                break
+            code = mm[offset + header:offset + header + code_len].decode()
+            if kind == PUT:
+                index[code] = offset
+                lengths[code] = end - offset
+            else:
+                index.pop(code, None)
+                lengths.pop(code, None)
+            offset = end
+        if offset < size:
+            # Torn or corrupt tail from a crash mid-append
+            if mm is not None:
+                mm.close()
+                mm = None
+            self._file.truncate(offset)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if offset:
+                mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped = (index, mm)
+        self._size = offset
+        self.live_bytes = sum(lengths.values())
+        return time.perf_counter() - began
+
+    # Writes
+
+    def _append(self, kind: int, code: str, long_url: str, expiry_time: Optional[int]) -> int:
+        """Write one record (not yet fsynced); returns its write sequence number"""
+        code_bytes, url_bytes = code.encode(), long_url.encode()
+        body = RECORD.pack(0, kind, len(code_bytes), len(url_bytes), expiry_time or 0)[4:] + code_bytes + url_bytes
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        with self._lock:
+            offset = self._size
+            self._file.write(record)
+            self._file.flush()
+            self._size += len(record)
+            previous = self.index.get(code)
+            if previous is not None:
+                self.live_bytes -= self._record_length(previous)
+            if kind == PUT:
+                self.index[code] = offset
+                self.live_bytes += len(record)
+            else:
+                self.index.pop(code, None)
+            self._written_seq += 1
+            return self._written_seq
+
+    def _wait_durable(self, seq: int) -> None:
+        """
+        Group commit: return once record `seq` is on disk
+
+        If no fsync is running this thread runs one covering everything
+        written so far; otherwise it waits for the running one and, if
+        that did not cover `seq`, for the next.
+        """
+        with self._synced:
+            while self._synced_seq < seq:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                target = self._written_seq
+                # compact() and close() wait for _syncing to clear before touching the file
+                log = self._file
+                self._synced.release()
+                try:
+                    os.fsync(log.fileno())
+                finally:
+                    self._synced.acquire()
+                    self._syncing = False
+                self.fsyncs += 1
+                self._synced_seq = max(self._synced_seq, target)
+                self._synced.notify_all()
+
+    def put(self, code: str, long_url: str, expiry_time: Optional[int] = None) -> None:
+        seq = self._append(PUT, code, long_url, expiry_time)
+        if self.sync:
+            self._wait_durable(seq)
+
+    def put_many(self, links: List[Tuple[str, str]], expiry_time: Optional[int] = None) -> None:
+        """
+        Store (code, long_url) pairs sharing one expiry with a single
+        write and (if sync) a single fsync
+        """
+        pack, crc32 = RECORD.pack, zlib.crc32
+        records = []
+        lengths = []
+        for code, long_url in links:
+            code_bytes, url_bytes = code.encode(), long_url.encode()
+            body = pack(0, PUT, len(code_bytes), len(url_bytes), expiry_time or 0)[4:] + code_bytes + url_bytes
+            records.append(crc32(body).to_bytes(4, "little") + body)
+            lengths.append(len(body) + 4)
+        with self._lock:
+            offset = self._size
+            self._file.write(b"".join(records))
+            self._file.flush()
+            index = self.index
+            for (code, _), length in zip(links, lengths):
+                previous = index.get(code)
+                if previous is not None:
+                    self.live_bytes -= self._record_length(previous)
+                index[code] = offset
+                offset += length
+            self.live_bytes += offset - self._size
+            self._size = offset
+            self._written_seq += 1
+            seq = self._written_seq
+        if self.sync:
+            self._wait_durable(seq)
+
+    def delete(self, code: str) -> bool:
+        if code not in self.index:
+            return False
+        seq = self._append(DELETE, code, "", None)
+        if self.sync:
+            self._wait_durable(seq)
+        return True
+
+    def flush(self) -> None:
+        """Make every write so far durable (for sync=False stores)"""
+        self._wait_durable(self._written_seq)
+
+    # Reads
+
+    def _remap(self, index: Dict[str, int], end: int) -> Optional[mmap.mmap]:
+        """
+        A map of `index`'s file covering at least `end` bytes, or None if a
+        compaction has replaced that index (the caller should retry)
+        """
+        with self._lock:
+            current, mm = self._mapped
+            if current is not index:
+                return None
+            if mm is None or len(mm) < end:
+                # Readers may still hold the old map; it is freed once they drop it
+                mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped = (index, mm)
+            return mm
+
+    def _view(self, end: int) -> mmap.mmap:
+        """Map of the current log up to `end`; for callers holding the lock"""
+        index, mm = self._mapped
+        if mm is None or len(mm) < end:
+            mm = self._remap(index, end)
+        return mm
+
+    def _record_length(self, offset: int) -> int:
+        _, _, code_len, url_len, _ = RECORD.unpack_from(self._view(offset + RECORD.size), offset)
+        return RECORD.size + code_len + url_len
+
+    def get(self, code: str) -> Optional[LinkRecord]:
+        while True:
+            index, mm = self._mapped
+            offset = index.get(code)
+            if offset is None:
+                return None
+            if mm is None or len(mm) < offset + RECORD.size:
+                mm = self._remap(index, offset + RECORD.size)
+                if mm is None:
+                    continue
+            _, _, code_len, url_len, expiry = RECORD.unpack_from(mm, offset)
+            start = offset + RECORD.size + code_len
+            if len(mm) < start + url_len:
+                mm = self._remap(index, start + url_len)
+                if mm is None:
+                    continue
+            return LinkRecord(mm[start:start + url_len].decode(), expiry or None)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def codes(self) -> Iterator[str]:
+        return iter(list(self.index))
+
+    def expiries(self) -> Iterator[Tuple[str, int]]:
+        """(code, expiry_time) of every link that expires, read from the record headers"""
+        with self._lock:
+            items = list(self.index.items())
+            mm = self._view(self._size) if self._size else None
+        unpack = RECORD.unpack_from
+        for code, offset in items:
+            expiry = unpack(mm, offset)[4]
+            if expiry:
+                yield code, expiry
+
+    # Compaction
+
+    @property
+    def garbage_ratio(self) -> float:
+        """Share of the log taken by overwritten, deleted or torn records"""
+        return 1.0 - self.live_bytes / self._size if self._size else 0.0
+
+    def compact(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Rewrite the log with only live records, dropping expired links
+
+        Writers wait for the duration. Reads keep going against the old
+        file until the new index and map are swapped in together.
+
+        Returns:
+            Bytes before and after and the number of expired links dropped
+        """
+        now = time.time() if now is None else now
+        tmp = f"{self.path}.compact"
+        with self._lock:
+            before = self._size
+            mm = self._view(before) if before else None
+            index: Dict[str, int] = {}
+            expired = 0
+            offset = 0
+            with open(tmp, "wb") as out:
+                for code, old in self.index.items():
+                    _, _, code_len, url_len, expiry = RECORD.unpack_from(mm, old)
+                    if expiry and expiry < now:
+                        expired += 1
+                        continue
+                    length = RECORD.size + code_len + url_len
+                    out.write(mm[old:old + length])
+                    index[code] = offset
+                    offset += length
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, self.path)
+            self._swap_file(reopen=True)
+            mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if offset else None
+            self.index = index
+            self._mapped = (index, mm)
+            self._size = self.live_bytes = offset
+        return {"bytes_before": before, "bytes_after": offset, "expired_dropped": expired}
+
+    def _compact_periodically(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            if self.garbage_ratio >= self.compact_garbage_ratio:
+                self.compact()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        self.flush()
+        with self._lock:
+            self._swap_file(reopen=False)
+            self._mapped = (self.index, None)
+
+    def _swap_file(self, reopen: bool) -> None:
+        """
+        Close the log file, reopening it at `path` if `reopen`, once no
+        fsync is using it; caller holds `_lock`, so nothing is written
+        meanwhile. A compacted log was fsynced before it replaced the old
+        one; on close, writes since the last group commit are synced here.
+        """
+        with self._synced:
+            while self._syncing:
+                self._synced.wait()
+            if not reopen and self._synced_seq < self._written_seq:
+                os.fsync(self._file.fileno())
+                self.fsyncs += 1
+            self._file.close()
+            if reopen:
+                self._file = open(self.path, "a+b")
+            self._synced_seq = self._written_seq
+            self._synced.notify_all()
+
+
+def benchmark_store(path: str, links: int = 200_000, writer_threads: int = 8) -> Dict[str, float]:
+    """
+    Measure durable write throughput, reopen (index rebuild) time and read rate
+
+    Writes are spread over `writer_threads` threads so concurrent puts share
+    fsyncs through group commit; the fsyncs-per-write figure shows how much.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    store = AppendOnlyURLStore(path)
+    per_thread = links // writer_threads
+
+    def writer(t: int) -> None:
+        for i in range(t * per_thread, (t + 1) * per_thread):
+            store.put(f"c{i}", f"https://example.com/articles/{i}?utm_source=newsletter")
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in range(writer_threads)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_seconds = time.perf_counter() - began
+    written = per_thread * writer_threads
+    fsyncs = store.fsyncs
+    store.close()
+
+    store = AppendOnlyURLStore(path)
+    began = time.perf_counter()
+    for i in range(0, written, 7):
+        store.get(f"c{i}")
+    read_seconds = time.perf_counter() - began
+    report = {
+        "writes_per_second": written / write_seconds,
+        "fsyncs_per_write": fsyncs / written,
+        "reopen_seconds": store.load_seconds,
+        "reads_per_second": len(range(0, written, 7)) / read_seconds
+    }
+    store.close()
+    os.remove(path)
+    return report